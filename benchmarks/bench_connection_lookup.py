@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-threaded benchmark of the connection lookup done by every get_connection call:
+the previous ReadWriteLock protected dict of lists (kept here, it is gone from the tree)
+against the real cvmConnectionManager._search_connection and _get_cvm_connection,
+the manager's mapping is seeded with stub connections so no host is contacted.
+
+usage: python benchmarks/bench_connection_lookup.py [-t THREADS] [-n LOOKUPS] [--hosts HOSTS]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+# no background task may touch the database or contact hosts during the benchmark
+SETTINGS = """
+SQLALCHEMY_DATABASE_URI = 'sqlite://'
+HOST_MONITOR_INTERVAL = 0
+DOMAIN_SAMPLER_INTERVAL = 0
+STORAGE_REFRESH_INTERVAL = 0
+LIBVIRT_POOL_MAINTENANCE_INTERVAL = 0
+JOB_WORKERS = 0
+LIBVIRT_WARMUP = False
+"""
+
+
+class StubConnection(object):
+    """stands in for a connected cvmConnection"""
+
+    connected = True
+
+    def __init__(self, host, conn):
+        self.host = host
+        self.type = conn
+
+
+class ReadWriteLockLookup(object):
+    """the previous lookup path of cvmConnectionManager._search_connection"""
+
+    def __init__(self, hosts, conn):
+        # imported late, importing virtmgr creates the app, see main
+        from virtmgr.libs.rwlock import ReadWriteLock
+
+        self._connections = dict((host, [StubConnection(host, conn)]) for host in hosts)
+        self._connections_lock = ReadWriteLock()
+
+    def search(self, host, conn):
+        self._connections_lock.acquireRead()
+        try:
+            if host in self._connections:
+                for connection in self._connections[host]:
+                    if connection.type == conn:
+                        return connection
+        finally:
+            self._connections_lock.release()
+        return None
+
+
+def seed_manager(manager, hosts, conn):
+    """publishes stub connections the way cvmConnectionManager does it (copy-on-write)"""
+    with manager._connections_lock:
+        connections = dict(manager._connections)
+        for host in hosts:
+            connections[(host, conn)] = StubConnection(host, conn)
+        manager._connections = types.MappingProxyType(connections)
+
+
+def run(search, hosts, conn, threads, lookups):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(lookups):
+            search(hosts[i % len(hosts)], conn)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.time()
+    for thread in workers:
+        thread.join()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-t', '--threads', type=int, default=16)
+    parser.add_argument('-n', '--lookups', type=int, default=50000, help='lookups per thread')
+    parser.add_argument('--hosts', type=int, default=100)
+    args = parser.parse_args()
+
+    # the settings have to be in place before the app gets imported
+    fd, settings = tempfile.mkstemp(prefix='virtmgr-bench-', suffix='.py')
+    with os.fdopen(fd, 'w') as f:
+        f.write(SETTINGS)
+    os.environ['VIRTMGR_SETTINGS'] = settings
+
+    from virtmgr.libs.connection import CONN_TCP, connection_manager
+
+    hosts = ['10.0.{}.{}'.format(i // 256, i % 256) for i in range(args.hosts)]
+    total = args.threads * args.lookups
+
+    seed_manager(connection_manager, hosts, CONN_TCP)
+    lookups = (
+        ('rwlock', ReadWriteLockLookup(hosts, CONN_TCP).search),
+        ('search', connection_manager._search_connection),
+        ('get', connection_manager._get_cvm_connection),
+    )
+
+    results = {}
+    for name, search in lookups:
+        elapsed = run(search, hosts, CONN_TCP, args.threads, args.lookups)
+        results[name] = elapsed
+        print('{:<8} {:>12.0f} lookups/s  {:>8.3f} us/lookup  ({} threads x {} lookups)'.format(
+            name, total / elapsed, elapsed * 1e6 / total, args.threads, args.lookups))
+
+    print('speedup  {:>12.1f}x (rwlock / search)'.format(results['rwlock'] / results['search']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible benchmark suite against the libvirt test driver. Runs the hot cvmConnect
+methods, util.get_xml_path and the api endpoints (through the flask test client on a
+sqlite database) and reports throughput and p50/p99 latency of every benchmark.
+
+usage: python benchmarks/bench_suite.py [--default] [--domains N] [--networks N] [--pools N]
+                                        [--volumes N] [--snapshots N] [--devices N] [-n ITERATIONS]
+                                        [-o results.json] [--baseline baseline.json] [--threshold 0.2]
+
+Without --default a test driver xml with the given number of objects is generated.
+With --baseline the exit status is 1 if a benchmark got slower than threshold
+(relative p50 latency or throughput) compared to the baseline results.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+SETTINGS = """
+SQLALCHEMY_DATABASE_URI = 'sqlite:///{db}'
+HOST_MONITOR_INTERVAL = 0
+DOMAIN_SAMPLER_INTERVAL = 0
+STORAGE_REFRESH_INTERVAL = 0
+LIBVIRT_POOL_MAINTENANCE_INTERVAL = 0
+JOB_WORKERS = 0
+LIBVIRT_WARMUP = False
+SLOW_REQUEST_THRESHOLD = None
+SERVER_STATS_CACHE_TTL = 0
+"""
+
+DOMAIN_XML = """  <domain type='test' xmlns:test='http://libvirt.org/schemas/domain/test/1.0'>
+    <name>{name}</name>
+    <memory>{memory}</memory>
+    <currentMemory>{memory}</currentMemory>
+    <vcpu>{vcpus}</vcpu>
+    <os><type arch='x86_64'>hvm</type></os>
+    <devices>
+      <disk type='file' device='disk'>
+        <source file='/guests/{name}.img'/>
+        <target dev='vda' bus='virtio'/>
+      </disk>
+      <interface type='network'>
+        <mac address='{mac}'/>
+        <source network='net-0'/>
+      </interface>
+    </devices>
+{snapshots}  </domain>
+"""
+
+SNAPSHOT_XML = """    <test:domainsnapshot>
+      <domainsnapshot>
+        <name>{name}</name>
+        <state>{state}</state>
+        <creationTime>{creation_time}</creationTime>
+{parent}      </domainsnapshot>
+    </test:domainsnapshot>
+"""
+
+NETWORK_XML = """  <network>
+    <name>net-{index}</name>
+    <bridge name='virbr{index}'/>
+    <ip address='10.{high}.{low}.1' netmask='255.255.255.0'/>
+  </network>
+"""
+
+POOL_XML = """  <pool type='dir'>
+    <name>pool-{index}</name>
+    <capacity unit='GiB'>1024</capacity>
+    <allocation unit='GiB'>{allocation}</allocation>
+    <available unit='GiB'>{available}</available>
+    <target><path>/pools/pool-{index}</path></target>
+{volumes}  </pool>
+"""
+
+VOLUME_XML = """    <volume>
+      <name>vol-{index}.img</name>
+      <capacity unit='GiB'>20</capacity>
+      <allocation unit='GiB'>2</allocation>
+    </volume>
+"""
+
+DEVICE_XML = """  <device>
+    <name>net_eth{index}_{mac_name}</name>
+    <parent>computer</parent>
+    <capability type='net'>
+      <interface>eth{index}</interface>
+      <address>{mac}</address>
+    </capability>
+  </device>
+"""
+
+
+def _mac(index):
+    return '52:54:00:{:02x}:{:02x}:{:02x}'.format((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff)
+
+
+def generate_node_xml(domains, networks, pools, volumes, snapshots, devices):
+    """returns a test driver xml with the given number of objects (snapshots and volumes per domain/pool)"""
+    parts = ["<node>\n  <cpu><nodes>2</nodes><sockets>2</sockets><cores>16</cores><threads>2</threads>"
+             "<active>128</active><mhz>2600</mhz><model>x86_64</model></cpu>\n  <memory>1073741824</memory>\n"]
+
+    for index in range(domains):
+        snapshot_xml = ''
+        for number in range(snapshots):
+            # a chain of snapshots, every one based on the previous
+            parent = '        <parent><name>snap-{}</name></parent>\n'.format(number - 1) if number else ''
+            snapshot_xml += SNAPSHOT_XML.format(name='snap-{}'.format(number), state='shutoff',
+                                                creation_time=1500000000 + number, parent=parent)
+        parts.append(DOMAIN_XML.format(name='guest-{:05d}'.format(index), memory=524288 * (1 + index % 8),
+                                       vcpus=1 + index % 4, mac=_mac(index), snapshots=snapshot_xml))
+
+    for index in range(networks):
+        parts.append(NETWORK_XML.format(index=index, high=index // 256 % 256, low=index % 256))
+
+    for index in range(pools):
+        allocation = volumes * 2
+        parts.append(POOL_XML.format(index=index, allocation=allocation, available=1024 - allocation,
+                                     volumes=''.join(VOLUME_XML.format(index=number) for number in range(volumes))))
+
+    for index in range(devices):
+        mac = _mac(0x100000 + index)
+        parts.append(DEVICE_XML.format(index=index, mac=mac, mac_name=mac.replace(':', '_')))
+
+    parts.append('</node>\n')
+    return ''.join(parts)
+
+
+def measure(func, iterations, warmup=3):
+    """calls func iterations times, returns throughput (calls/s) and latency percentiles (s)"""
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'throughput': iterations / elapsed if elapsed > 0 else None,
+        'mean': sum(latencies) / len(latencies),
+        'p50': latencies[int(0.50 * (len(latencies) - 1))],
+        'p99': latencies[int(0.99 * (len(latencies) - 1))],
+    }
+
+
+def compare(results, baseline, threshold):
+    """returns (name, reason) of every benchmark which regressed past threshold"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base['p50'] and result['p50'] > base['p50'] * (1 + threshold):
+            regressions.append((name, 'p50 {:.3f}ms -> {:.3f}ms'.format(base['p50'] * 1000, result['p50'] * 1000)))
+        elif base['throughput'] and result['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append((name, 'throughput {:.1f}/s -> {:.1f}/s'.format(
+                base['throughput'], result['throughput'])))
+    return regressions
+
+
+def run(args, host):
+    # the settings have to be in place before the app gets imported
+    workdir = tempfile.mkdtemp(prefix='virtmgr-bench-')
+    settings = os.path.join(workdir, 'settings.py')
+    with open(settings, 'w') as f:
+        f.write(SETTINGS.format(db=os.path.join(workdir, 'bench.db')))
+    os.environ['VIRTMGR_SETTINGS'] = settings
+
+    from virtmgr import app, db
+    from virtmgr.libs import util
+    from virtmgr.libs.connection import CONN_TEST, cvmConnect
+    from virtmgr.models import HostServer
+
+    with app.app_context():
+        db.create_all()
+        server_host = HostServer(name='bench', hostname=host, ssh_login='bench', ssh_password='bench', type=CONN_TEST)
+        db.session.add(server_host)
+        db.session.commit()
+        server_id = server_host.id
+
+    with cvmConnect(host, CONN_TEST) as conn:
+        domain_xmls = [dom.XMLDesc(0) for dom in conn.cvm.listAllDomains(0)]
+    position = [0]
+
+    def get_xml_path():
+        # cycle through all domains, so large inventories also measure cache misses
+        xml = domain_xmls[position[0] % len(domain_xmls)]
+        position[0] += 1
+        util.get_xml_path(xml, '/domain/devices/interface/mac/@address')
+
+    def conn_call(method):
+        def call():
+            with cvmConnect(host, CONN_TEST) as conn:
+                getattr(conn, method)()
+        return call
+
+    client = app.test_client()
+
+    def endpoint(url):
+        def call():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError('GET {} returned {}'.format(url, response.status_code))
+        return call
+
+    prefix = '/cmpvirtmgr_api'
+    benchmarks = [
+        ('get_instances', conn_call('get_instances')),
+        ('get_host_instances', conn_call('get_host_instances')),
+        ('get_snapshots', conn_call('get_snapshots')),
+        ('get_net_device', conn_call('get_net_device')),
+        ('get_xml_path', get_xml_path),
+        ('GET /servers/', endpoint(prefix + '/servers/')),
+        ('GET /servers/<id>/', endpoint('{}/servers/{}/'.format(prefix, server_id))),
+        ('GET /servers/<id>/domains/', endpoint('{}/servers/{}/domains/'.format(prefix, server_id))),
+        ('GET /servers/<id>/net_pools/', endpoint('{}/servers/{}/net_pools/'.format(prefix, server_id))),
+        ('GET /servers/<id>/storage_pools/', endpoint('{}/servers/{}/storage_pools/'.format(prefix, server_id))),
+        ('GET /servers/stats/', endpoint(prefix + '/servers/stats/')),
+    ]
+
+    results = {}
+    for name, func in benchmarks:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        results[name] = measure(func, args.iterations)
+        print('{:<36} {:>10.1f}/s  p50 {:>9.3f}ms  p99 {:>9.3f}ms'.format(
+            name, results[name]['throughput'], results[name]['p50'] * 1000, results[name]['p99'] * 1000))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--default', action='store_true', help='use test:///default instead of a generated xml')
+    parser.add_argument('--domains', type=int, default=2000)
+    parser.add_argument('--networks', type=int, default=200)
+    parser.add_argument('--pools', type=int, default=50)
+    parser.add_argument('--volumes', type=int, default=40, help='volumes per pool')
+    parser.add_argument('--snapshots', type=int, default=3, help='snapshots per domain')
+    parser.add_argument('--devices', type=int, default=100, help='net node devices')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--only', nargs='*', help='run only benchmarks whose name contains one of these')
+    parser.add_argument('-o', '--output', help='write the results as json')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    import libvirt
+
+    if args.default:
+        host = 'default'
+    else:
+        fd, host = tempfile.mkstemp(prefix='virtmgr-bench-', suffix='.xml')
+        with os.fdopen(fd, 'w') as f:
+            f.write(generate_node_xml(args.domains, args.networks, args.pools, args.volumes,
+                                      args.snapshots, args.devices))
+
+    results = run(args, host)
+
+    report = {
+        'meta': {
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'libvirt': libvirt.getVersion(),
+            'host': host if args.default else 'generated',
+            'params': dict((key, getattr(args, key)) for key in
+                           ('domains', 'networks', 'pools', 'volumes', 'snapshots', 'devices', 'iterations')),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta']['params'] != report['meta']['params']:
+            print('warning: baseline was recorded with different parameters')
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, reason in regressions:
+            print('REGRESSION {}: {}'.format(name, reason))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of util.get_xml_path against the previous parse-per-call
+implementation. Runs the queries get_host_instances used to do on a domain xml.
+
+usage: python benchmarks/bench_xml_path.py [domain.xml] [-n ROUNDS]
+
+domain.xml can be any dump of `virsh dumpxml`, a typical kvm domain is used otherwise.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+import libxml2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from virtmgr.libs import util  # noqa: E402
+
+
+DOMAIN_XML = """<domain type='kvm' id='7'>
+  <name>bench-guest</name>
+  <uuid>5b8c1a38-5f7e-4c2a-9d57-2f6e3c1b9a01</uuid>
+  <memory unit='KiB'>8388608</memory>
+  <currentMemory unit='KiB'>8388608</currentMemory>
+  <vcpu placement='static' current='2'>4</vcpu>
+  <resource>
+    <partition>/machine</partition>
+  </resource>
+  <os>
+    <type arch='x86_64' machine='pc-i440fx-rhel7.0.0'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <features>
+    <acpi/>
+    <apic/>
+  </features>
+  <cpu mode='custom' match='exact' check='full'>
+    <model fallback='forbid'>Haswell-noTSX</model>
+    <feature policy='require' name='vme'/>
+    <feature policy='require' name='ss'/>
+    <feature policy='require' name='hypervisor'/>
+  </cpu>
+  <clock offset='utc'>
+    <timer name='rtc' tickpolicy='catchup'/>
+    <timer name='pit' tickpolicy='delay'/>
+    <timer name='hpet' present='no'/>
+  </clock>
+  <on_poweroff>destroy</on_poweroff>
+  <on_reboot>restart</on_reboot>
+  <on_crash>restart</on_crash>
+  <devices>
+    <emulator>/usr/libexec/qemu-kvm</emulator>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2' cache='none'/>
+      <source file='/var/lib/libvirt/images/bench-guest.qcow2'/>
+      <backingStore/>
+      <target dev='vda' bus='virtio'/>
+      <alias name='virtio-disk0'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x06' function='0x0'/>
+    </disk>
+    <disk type='file' device='cdrom'>
+      <driver name='qemu' type='raw'/>
+      <target dev='hda' bus='ide'/>
+      <readonly/>
+      <alias name='ide0-0-0'/>
+      <address type='drive' controller='0' bus='0' target='0' unit='0'/>
+    </disk>
+    <controller type='usb' index='0' model='ich9-ehci1'>
+      <alias name='usb'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x05' function='0x7'/>
+    </controller>
+    <controller type='pci' index='0' model='pci-root'>
+      <alias name='pci.0'/>
+    </controller>
+    <interface type='bridge'>
+      <mac address='52:54:00:6b:3c:58'/>
+      <source bridge='br0'/>
+      <target dev='vnet3'/>
+      <model type='virtio'/>
+      <alias name='net0'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x03' function='0x0'/>
+    </interface>
+    <serial type='pty'>
+      <source path='/dev/pts/3'/>
+      <target type='isa-serial' port='0'/>
+      <alias name='serial0'/>
+    </serial>
+    <console type='pty' tty='/dev/pts/3'>
+      <source path='/dev/pts/3'/>
+      <target type='serial' port='0'/>
+      <alias name='serial0'/>
+    </console>
+    <input type='tablet' bus='usb'>
+      <alias name='input0'/>
+      <address type='usb' bus='0' port='1'/>
+    </input>
+    <graphics type='vnc' port='5903' autoport='yes' listen='0.0.0.0'>
+      <listen type='address' address='0.0.0.0'/>
+    </graphics>
+    <video>
+      <model type='cirrus' vram='16384' heads='1' primary='yes'/>
+      <alias name='video0'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x02' function='0x0'/>
+    </video>
+    <memballoon model='virtio'>
+      <alias name='balloon0'/>
+      <address type='pci' domain='0x0000' bus='0x00' slot='0x07' function='0x0'/>
+    </memballoon>
+  </devices>
+</domain>
+"""
+
+QUERIES = ['/domain/currentMemory', '/domain/vcpu/@current', '/domain/vcpu']
+
+
+def get_xml_path_uncached(xml, path):
+    """the previous implementation: parse, evaluate and free on every call"""
+    doc = None
+    ctx = None
+    result = None
+    try:
+        doc = libxml2.parseDoc(xml)
+        ctx = doc.xpathNewContext()
+        ret = ctx.xpathEval(path)
+        if ret is not None:
+            if type(ret) == list:
+                if len(ret) >= 1:
+                    result = ret[0].content
+            else:
+                result = ret
+    finally:
+        if doc:
+            doc.freeDoc()
+        if ctx:
+            ctx.xpathFreeContext()
+    return result
+
+
+def run_uncached(xml):
+    for path in QUERIES:
+        get_xml_path_uncached(xml, path)
+
+
+def run_cached(xml):
+    for path in QUERIES:
+        util.get_xml_path(xml, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('xml', nargs='?', help='domain xml file')
+    parser.add_argument('-n', '--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.xml:
+        with open(args.xml) as f:
+            xml = f.read()
+    else:
+        xml = DOMAIN_XML
+
+    for path in QUERIES:
+        assert get_xml_path_uncached(xml, path) == util.get_xml_path(xml, path), path
+
+    results = {}
+    for name, func in (('uncached', run_uncached), ('cached', run_cached)):
+        util.xml_doc_cache.clear()
+        elapsed = timeit.timeit(lambda: func(xml), number=args.rounds)
+        results[name] = elapsed
+        print('{:<10} {:>10.2f} us/round  ({} queries per round, {} rounds)'.format(
+            name, elapsed * 1e6 / args.rounds, len(QUERIES), args.rounds))
+
+    print('speedup    {:>10.1f}x'.format(results['uncached'] / results['cached']))
+
+
+if __name__ == '__main__':
+    main()
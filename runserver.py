@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 from virtmgr import app
+from virtmgr.startup import start_background_tasks, start_job_manager
 
 
 if __name__ == '__main__':
+    # with the reloader only its child process serves requests
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
+        start_job_manager()
     app.run('0.0.0.0', '8909')
@@ -14,6 +14,8 @@ flask_api = flask_restful.Api(_api_blueprint)
 app = flask.Flask('virtmgr')
 app.register_blueprint(_api_blueprint, url_prefix='/cmpvirtmgr_api')
 app.config.from_object(DevelopmentConfig)
+# optional python file overriding the settings, e.g. database and background tasks of benchmarks
+app.config.from_envvar('VIRTMGR_SETTINGS', silent=True)
 
 db = flask_sqlalchemy.SQLAlchemy(app)
 
@@ -23,3 +25,9 @@ def initdb():
 
 
 from virtmgr.urls import *
+
+
+from virtmgr.libs import profiling
+
+profiling.init_app(app, flask_api)
+
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import uuid
+
+from functools import wraps
+
+from flask import Response, after_this_request, request
+
+from virtmgr.api import listing
+from virtmgr.libs.connection import connection_manager
+from virtmgr.models import HostServer
+
+
+# generations start over with every process, the epoch keeps old etags from matching
+_EPOCH = uuid.uuid4().hex
+
+
+def host_etag(server_host, kind, representation):
+    """ 根据server的资源代数（generation）和响应格式生成ETag，未连接时返回None """
+    generation = connection_manager.get_generation(server_host.hostname, server_host.type, kind)
+    if generation is None:
+        return None
+    key = '{}|{}|{}|{}|{}'.format(_EPOCH, server_host.hostname, kind, generation, representation)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(kind):
+    """
+    makes GET of a host resource conditional on the generation of the given kind:
+    the response carries an ETag and If-None-Match is answered with 304 without any libvirt call
+    the loaded server is passed to the resource as server_host, the format is negotiated
+    by the Accept header, so responses vary by it
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(resource, server_id, *args, **kwargs):
+            server_host = HostServer.query.filter_by(id=server_id).first_or_404(
+                description='Server {} Not Exist'.format(server_id))
+            kwargs['server_host'] = server_host
+
+            @after_this_request
+            def vary(response):
+                response.vary.add('Accept')
+                return response
+
+            # the etag has to be taken before the data, a change in between only causes a refetch
+            etag = host_etag(server_host, kind, 'ndjson' if listing.wants_ndjson() else 'json')
+            if etag is None:
+                return func(resource, server_id, *args, **kwargs)
+
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            @after_this_request
+            def set_etag(response):
+                if response.status_code == 200:
+                    response.set_etag(etag)
+                return response
+
+            return func(resource, server_id, *args, **kwargs)
+        return wrapper
+    return decorator
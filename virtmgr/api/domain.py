@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+from flask import request
+from flask_restful import abort
+from libvirt import libvirtError
+
+from virtmgr.api import listing
+from virtmgr.api.conditional import conditional
+from virtmgr.api.server import ServerBaseResource
+from virtmgr.libs import util
+from virtmgr.libs.connection import DOMAIN_ACTIONS, cvmConnect
+from virtmgr import app
+from virtmgr.models import HostServer
+from virtmgr.libs.inventory import DOMAIN_STATE_NAMES, GEN_DOMAIN
+from virtmgr.libs.sampler import domain_sampler
+
+
+DOMAIN_FIELDS = ('name', 'uuid', 'id', 'state', 'state_name')
+
+
+class DomainsR(ServerBaseResource):
+
+    @conditional(GEN_DOMAIN)
+    def get(self, server_id, server_host):
+        """ 获取虚机列表（支持游标分页、按name/state过滤、fields投影及NDJSON流式输出） """
+        fields = listing.get_fields(DOMAIN_FIELDS)
+        limit = listing.get_limit()
+
+        state = request.args.get('state')
+        if state is not None:
+            states = dict((state_name, state_id) for state_id, state_name in DOMAIN_STATE_NAMES.items())
+            if state not in states:
+                abort(400, message='Unknown state {}'.format(state))
+            state = states[state]
+
+        try:
+            with cvmConnect(server_host.hostname, server_host.type) as conn:
+                domains = conn.get_domains()
+        except libvirtError as err:
+            abort(500, message=str(err))
+
+        name = request.args.get('name')
+        cursor = listing.decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        # domains are sorted by name, the name of the last row is the cursor
+        rows = (dict(dom, state_name=DOMAIN_STATE_NAMES.get(dom['state'])) for dom in domains
+                if (cursor is None or dom['name'] > cursor) and
+                (not name or name in dom['name']) and
+                (state is None or dom['state'] == state))
+
+        if listing.wants_ndjson():
+            if limit is not None:
+                rows = itertools.islice(rows, limit)
+            return listing.stream_ndjson(listing.project(row, fields) for row in rows)
+
+        page, next_cursor = listing.paginate(rows, limit, lambda row: row['name'])
+        result = {'domains': [listing.project(row, fields) for row in page]}
+        if limit is not None:
+            result['next_cursor'] = next_cursor
+        return result
+
+
+class DomainUsageR(ServerBaseResource):
+
+    def get(self, server_id, name):
+        """ 获取虚机最近一段时间（window秒）的cpu/内存/磁盘/网络使用情况 """
+        server_host = self.query.filter_by(id=server_id).first_or_404(
+            description='Server {} Not Exist'.format(server_id))
+        window = request.args.get('window', type=float)
+        return {'name': name, 'window': window,
+                'usage': domain_sampler.summary(server_host.hostname, name, window)}
+
+
+class DomainActionsR(ServerBaseResource):
+
+    def post(self):
+        """ 批量虚机电源操作：按server分组并发执行，返回每一项的结果 """
+        data = request.get_json() or {}
+        action = data.get('action')
+        if action not in DOMAIN_ACTIONS:
+            abort(400, message='action must be one of {}'.format(', '.join(sorted(DOMAIN_ACTIONS))))
+        items = data.get('items') or []
+        try:
+            items = [(int(item['server_id']), item['domain']) for item in items]
+        except (KeyError, TypeError, ValueError):
+            abort(400, message='items must be a list of {server_id, domain}')
+
+        by_server = {}
+        for server_id, domain in items:
+            by_server.setdefault(server_id, set()).add(domain)
+        server_hosts = dict((server_host.id, server_host) for server_host in
+                            self.query.filter(HostServer.id.in_(list(by_server))))
+
+        timeout = app.config['BULK_ACTION_TIMEOUT']
+
+        def run_server(server_id):
+            server_host = server_hosts[server_id]
+            with cvmConnect(server_host.hostname, server_host.type) as conn:
+                return conn.bulk_domain_action(
+                    sorted(by_server[server_id]), action, app.config['BULK_ACTION_PER_HOST'], timeout)
+
+        results = util.map_concurrently(
+            run_server, [server_id for server_id in by_server if server_id in server_hosts],
+            app.config['BULK_ACTION_HOST_CONCURRENCY'], timeout)
+
+        response = []
+        for server_id, domain in items:
+            if server_id not in server_hosts:
+                error = 'Server {} Not Exist'.format(server_id)
+            else:
+                domain_results, server_error = results[server_id]
+                error = str(server_error) if server_error is not None else domain_results[domain]
+            response.append({'server_id': server_id, 'domain': domain, 'ok': error is None, 'error': error})
+        return {'action': action, 'results': response}
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from flask import request, url_for
+from flask_restful import Resource, abort
+
+from virtmgr.api.schemas import JobSchema
+from virtmgr.libs.jobs import cvmJobsUnavailable, job_manager
+from virtmgr.models import HostServer, Job
+
+
+class JobsR(Resource):
+
+    def post(self):
+        """ 提交异步任务，立即返回202，通过 /jobs/<id>/ 轮询状态 """
+        data = request.get_json() or {}
+        if not data.get('type') or not data.get('server_id'):
+            abort(400, message='type and server_id are required')
+        server_host = HostServer.query.filter_by(id=data['server_id']).first_or_404(
+            description='Server {} Not Exist'.format(data['server_id']))
+        try:
+            job = job_manager.submit(data['type'], server_host, data.get('params'))
+        except ValueError as err:
+            abort(400, message=str(err))
+        except cvmJobsUnavailable as err:
+            abort(503, message=str(err))
+        return JobSchema().dump(job), 202, {'Location': url_for('api.jobr', job_id=job.id)}
+
+
+class JobR(Resource):
+
+    def get(self, job_id):
+        """ 获取任务状态和进度 """
+        job = Job.query.filter_by(id=job_id).first_or_404(description='Job {} Not Exist'.format(job_id))
+        return JobSchema().dump(job)
+
+    def delete(self, job_id):
+        """ 取消任务（运行中的任务会被通知停止） """
+        job = Job.query.filter_by(id=job_id).first_or_404(description='Job {} Not Exist'.format(job_id))
+        if not job_manager.cancel(job):
+            abort(409, message='Job {} already finished'.format(job_id))
+        return JobSchema().dump(job), 202
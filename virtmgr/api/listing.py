@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import itertools
+import json
+
+from flask import Response, request, stream_with_context
+from flask_restful import abort
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ 解析分页游标，非法游标返回400 """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        abort(400, message='Invalid cursor {}'.format(cursor))
+
+
+def get_limit(default=None, maximum=1000):
+    limit = request.args.get('limit', default, type=int)
+    if limit is not None and limit <= 0:
+        abort(400, message='limit must be positive')
+    return min(limit, maximum) if limit is not None else None
+
+
+def get_fields(allowed):
+    """ 解析fields=a,b,c投影参数，未指定时返回None（全部字段） """
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        abort(400, message='Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    return fields
+
+
+def project(row, fields):
+    if fields is None:
+        return row
+    return dict((field, row.get(field)) for field in fields)
+
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(rows):
+    """
+    streams rows (an iterable of dicts) as newline delimited json while they are produced,
+    memory stays flat and the first rows go out right away
+    """
+    def generate():
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def paginate(rows, limit, cursor_of):
+    """
+    takes up to limit rows from the iterable, returns (page, next cursor or None)
+    cursor_of returns the cursor value of a row (the sort key the rows are ordered by)
+    """
+    if limit is None:
+        return list(rows), None
+    page = list(itertools.islice(rows, limit + 1))
+    if len(page) > limit:
+        page = page[:limit]
+        return page, encode_cursor(cursor_of(page[-1]))
+    return page, None
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from flask import Response
+from flask_restful import Resource
+
+from virtmgr.libs import metrics
+from virtmgr.libs.connection import connection_manager
+
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsR(Resource):
+
+    def get(self):
+        """ Prometheus格式的libvirt调用延迟、错误数及连接状态指标 """
+        lines = metrics.render_call_metrics()
+        lines.extend(metrics.render_transport_metrics())
+        lines.extend(metrics.render_connection_metrics(connection_manager.connections()))
+        return Response('\n'.join(lines) + '\n', mimetype=PROMETHEUS_MIMETYPE)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from flask import Response
+from flask_restful import Resource
+
+from virtmgr.libs.profiling import request_profiler
+
+
+class ProfileR(Resource):
+
+    def get(self):
+        """ 下载采样分析结果（collapsed stacks格式，可直接生成火焰图） """
+        return Response(request_profiler.collapsed(), mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename=virtmgr.collapsed'})
+
+    def delete(self):
+        """ 清空采样分析结果 """
+        request_profiler.reset()
+        return '', 204
@@ -4,14 +4,32 @@ import flask_marshmallow
 from marshmallow import fields
 
 from virtmgr import app, models
+from virtmgr.libs.profiling import TIME_SERIALIZATION, request_timer
 
 
 ma = flask_marshmallow.Marshmallow(app)
 
 
-class ServerSchema(ma.ModelSchema):
+class BaseSchema(ma.ModelSchema):
+
+    def dump(self, obj, many=None):
+        with request_timer.measure(TIME_SERIALIZATION):
+            return super(BaseSchema, self).dump(obj, many=many)
+
+
+class ServerSchema(BaseSchema):
     class Meta:
         model = models.HostServer
         exclude = ('type', 'ssh_login', 'ssh_password')
 
     is_alive = fields.Boolean()
+
+
+class JobSchema(BaseSchema):
+    class Meta:
+        model = models.Job
+        exclude = ('server',)
+
+    server_id = fields.Integer()
+    params = fields.Function(lambda job: job.get_params())
+    result = fields.Function(lambda job: job.get_result())
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+import threading
+import time
+
 from flask import request
 from flask_restful import Resource, abort
 from libvirt import libvirtError
 
+from virtmgr.api import listing
+from virtmgr.api.conditional import conditional
+from virtmgr.libs import util
+from virtmgr.libs.inventory import GEN_NETWORK
 from virtmgr.libs.connection import cvmConnect
-from virtmgr import db
+from virtmgr.libs.monitor import host_monitor
+from virtmgr import app, db
 from virtmgr.api.schemas import ServerSchema
 from virtmgr.models import HostServer
 
@@ -21,11 +30,39 @@ class ServersR(ServerBaseResource):
     # session = db.session
 
     def get(self):
-        """ 获取server列表 """
-        server_hosts = self.query.all()
-        if not server_hosts:
-            return {'servers': []}
-        return {'servers': ServerSchema().dump(server_hosts, many=True)}
+        """ 获取server列表（支持游标分页、按name/host/state过滤、fields投影及NDJSON流式输出） """
+        fields = listing.get_fields(ServerSchema().fields)
+        limit = listing.get_limit()
+        state = request.args.get('state')
+        if state not in (None, 'up', 'down'):
+            abort(400, message='state must be up or down')
+
+        query = self.query.order_by(HostServer.id)
+        if request.args.get('name'):
+            query = query.filter(HostServer.name.contains(request.args['name']))
+        if request.args.get('host'):
+            query = query.filter(HostServer.hostname.contains(request.args['host']))
+        if request.args.get('cursor'):
+            query = query.filter(HostServer.id > listing.decode_cursor(request.args['cursor']))
+
+        # rows are fetched in batches, so large listings never sit in memory as a whole
+        server_hosts = query.yield_per(100)
+        if state is not None:
+            # is_alive is read from the host monitor cache, no host is probed here,
+            # hosts of unknown state (monitor disabled or not probed yet) match neither filter
+            server_hosts = (server_host for server_host in server_hosts if server_host.is_alive == (state == 'up'))
+
+        schema = ServerSchema(only=fields)
+        if listing.wants_ndjson():
+            if limit is not None:
+                server_hosts = itertools.islice(server_hosts, limit)
+            return listing.stream_ndjson(schema.dump(server_host) for server_host in server_hosts)
+
+        page, next_cursor = listing.paginate(server_hosts, limit, lambda server_host: server_host.id)
+        result = {'servers': schema.dump(page, many=True)}
+        if limit is not None:
+            result['next_cursor'] = next_cursor
+        return result
 
     def post(self):
         """ 添加新的宿主server """
@@ -40,6 +77,98 @@ class ServersR(ServerBaseResource):
         return ServerSchema().dump(server_host)
 
 
+class ServersStatsR(ServerBaseResource):
+
+    # (expires at, result) of the last collection, shared by all requests
+    _cache = None
+    _cache_lock = threading.Lock()
+
+    @staticmethod
+    def _collect_one(target):
+        server_id, hostname, conn = target
+        # do not wait for connect timeouts of hosts the monitor knows to be down
+        status = host_monitor.status(hostname)
+        if status is not None and not status['alive']:
+            raise libvirtError('host is down: {}'.format(status['last_error']))
+        with cvmConnect(hostname, conn) as cvm:
+            return cvm.get_node_stats()
+
+    def _collect(self):
+        server_hosts = self.query.all()
+        results = util.map_concurrently(
+            self._collect_one,
+            [(server_host.id, server_host.hostname, server_host.type) for server_host in server_hosts],
+            max_workers=app.config['SERVER_STATS_CONCURRENCY'],
+            item_timeout=app.config['SERVER_STATS_TIMEOUT'])
+
+        servers = []
+        totals = {'servers': len(server_hosts), 'reachable': 0, 'cpus': 0, 'memory': 0, 'free_memory': 0,
+                  'domains': {'total': 0, 'active': 0, 'inactive': 0}}
+        for server_host in server_hosts:
+            stats, error = results[(server_host.id, server_host.hostname, server_host.type)]
+            servers.append({'id': server_host.id, 'name': server_host.name, 'hostname': server_host.hostname,
+                            'stats': stats, 'error': str(error) if error is not None else None})
+            if error is None:
+                totals['reachable'] += 1
+                for key in ('cpus', 'memory', 'free_memory'):
+                    totals[key] += stats[key]
+                for key in ('total', 'active', 'inactive'):
+                    totals['domains'][key] += stats['domains'][key]
+        return {'servers': servers, 'totals': totals, 'collected_at': time.time()}
+
+    def get(self):
+        """ 获取所有server的汇总统计（部分server失败时返回部分结果） """
+        cache = ServersStatsR._cache
+        if cache is not None and cache[0] > time.time():
+            return cache[1]
+
+        # only one request fans out to the hypervisors, concurrent pollers wait for its result
+        with ServersStatsR._cache_lock:
+            cache = ServersStatsR._cache
+            if cache is not None and cache[0] > time.time():
+                return cache[1]
+            result = self._collect()
+            ServersStatsR._cache = (time.time() + app.config['SERVER_STATS_CACHE_TTL'], result)
+        return result
+
+
+class ServersStorageR(ServerBaseResource):
+
+    @staticmethod
+    def _collect_one(target):
+        server_id, hostname, conn = target
+        status = host_monitor.status(hostname)
+        if status is not None and not status['alive']:
+            raise libvirtError('host is down: {}'.format(status['last_error']))
+        with cvmConnect(hostname, conn) as cvm:
+            capacity = cvm.get_storage_capacity()
+        if capacity is None:
+            raise libvirtError('storage inventory not synced yet')
+        return capacity
+
+    def get(self):
+        """ 获取所有server的存储容量汇总（来自各server的存储池索引） """
+        server_hosts = self.query.all()
+        results = util.map_concurrently(
+            self._collect_one,
+            [(server_host.id, server_host.hostname, server_host.type) for server_host in server_hosts],
+            max_workers=app.config['SERVER_STORAGE_CONCURRENCY'],
+            item_timeout=app.config['SERVER_STORAGE_TIMEOUT'])
+
+        servers = []
+        totals = {'servers': len(server_hosts), 'reachable': 0, 'pools': 0, 'capacity': 0, 'allocation': 0,
+                  'available': 0}
+        for server_host in server_hosts:
+            capacity, error = results[(server_host.id, server_host.hostname, server_host.type)]
+            servers.append({'id': server_host.id, 'name': server_host.name, 'hostname': server_host.hostname,
+                            'storage': capacity, 'error': str(error) if error is not None else None})
+            if error is None:
+                totals['reachable'] += 1
+                for key in ('pools', 'capacity', 'allocation', 'available'):
+                    totals[key] += capacity[key]
+        return {'servers': servers, 'totals': totals}
+
+
 class ServerR(ServerBaseResource):
     # query = HostServer.query
     # session = db.session
@@ -54,12 +183,23 @@ class ServerR(ServerBaseResource):
         return ServerSchema().dump(server_host)
 
 
-class NetPoolsR(ServerBaseResource):
+class ServerStatusR(ServerBaseResource):
 
     def get(self, server_id):
-        """ 获取网络池列表 """
+        """ 获取server健康状态（来自后台监控缓存） """
         server_host = self.query.filter_by(id=server_id).first_or_404(
             description='Server {} Not Exist'.format(server_id))
+        status = server_host.status
+        if status is None:
+            return {'status': 'unknown'}
+        return status
+
+
+class NetPoolsR(ServerBaseResource):
+
+    @conditional(GEN_NETWORK)
+    def get(self, server_id, server_host):
+        """ 获取网络池列表 """
         try:
             conn = cvmConnect(server_host.hostname, server_host.type)
             net_pools = conn.get_networks()
@@ -68,3 +208,16 @@ class NetPoolsR(ServerBaseResource):
             abort(500, message=str(err))
         return {'net_pools': net_pools}
 
+
+class StoragePoolsR(ServerBaseResource):
+
+    def get(self, server_id):
+        """ 获取存储池列表（含容量和卷） """
+        server_host = self.query.filter_by(id=server_id).first_or_404(
+            description='Server {} Not Exist'.format(server_id))
+        try:
+            with cvmConnect(server_host.hostname, server_host.type) as conn:
+                storage_pools = conn.get_storage_pools()
+        except libvirtError as err:
+            abort(500, message=str(err))
+        return {'storage_pools': storage_pools}
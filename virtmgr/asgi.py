@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI serving mode, e.g. `uvicorn virtmgr.asgi:application`
+
+Requests are held as coroutines on the event loop, the flask app itself runs in
+thread pools: every server (the <server_id> of the url) gets its own bounded executor
+for routes which talk to its hypervisor, routes only touching the database and fleet
+wide routes share one executor. A hung hypervisor can only exhaust the executor of
+its own server, requests waiting longer than ASGI_TIMEOUT get a 504.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import io
+import json
+import re
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from virtmgr import app
+from virtmgr.startup import start_background_tasks, start_job_manager
+
+
+# routes below /servers/<server_id>/ which are answered from the database or caches only
+DB_ONLY_SUBPATHS = ('', 'status/')
+
+
+class _ClientGone(Exception):
+    """raised on the worker thread when nobody reads the response anymore"""
+
+
+class cvmASGIApp(object):
+    """
+    bridges ASGI http requests to a WSGI app running in per server bounded executors
+    """
+
+    def __init__(self, wsgi_app, prefix='', host_workers=4, shared_workers=32, timeout=30, max_hosts=256,
+                 queue_size=16):
+        self.wsgi_app = wsgi_app
+        self.host_workers = host_workers
+        self.timeout = timeout
+        self.max_hosts = max_hosts
+        # body chunks buffered per response, a slow client blocks the worker thread instead
+        self.queue_size = queue_size
+        self.shared_executor = ThreadPoolExecutor(max_workers=shared_workers, thread_name_prefix='asgi-shared')
+        # maps server ids to their executor, the least recently used first, only touched
+        # from the event loop thread. bounded, the ids of the urls are not validated here
+        self.host_executors = collections.OrderedDict()
+        self._server_route = re.compile(r'^{}/servers/(\d+)/(.*)$'.format(re.escape(prefix)))
+
+    def executor_for(self, path):
+        match = self._server_route.match(path)
+        if match is None or match.group(2) in DB_ONLY_SUBPATHS:
+            return self.shared_executor
+
+        server_id = int(match.group(1))
+        executor = self.host_executors.get(server_id)
+        if executor is not None:
+            self.host_executors.move_to_end(server_id)
+            return executor
+
+        if len(self.host_executors) >= self.max_hosts:
+            # running requests of the evicted executor still finish, its threads end after them
+            _, evicted = self.host_executors.popitem(last=False)
+            evicted.shutdown(wait=False)
+        executor = self.host_executors[server_id] = ThreadPoolExecutor(
+            max_workers=self.host_workers, thread_name_prefix='asgi-server-{}'.format(server_id))
+        return executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError('unsupported scope type {}'.format(scope['type']))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # background tasks and job workers need the database, they are not started on import
+                await asyncio.get_running_loop().run_in_executor(self.shared_executor, start_background_tasks)
+                await asyncio.get_running_loop().run_in_executor(self.shared_executor, start_job_manager)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shared_executor.shutdown(wait=False)
+                for executor in self.host_executors.values():
+                    executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            # wsgi strings are latin-1 decoded bytes
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = 'HTTP_' + name
+                environ[key] = environ[key] + ',' + value if key in environ else value
+        return environ
+
+    def _serve(self, environ, loop, queue, gone):
+        """
+        runs the wsgi app and hands its status, headers and body chunks to the queue
+        the whole response is produced on one thread, flask request contexts are thread bound
+        putting blocks while the queue is full, so the app is not faster than the client
+        """
+        def put(item):
+            if gone.is_set():
+                raise _ClientGone()
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            except RuntimeError:
+                # the event loop is gone (shutdown), nobody waits for the response anymore
+                raise _ClientGone()
+            try:
+                future.result(self.timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise _ClientGone()
+
+        def start_response(status, headers, exc_info=None):
+            put((int(status.split(' ', 1)[0]),
+                 [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+            return put
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        put(chunk)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            put(None)
+        except _ClientGone:
+            pass
+        except Exception:
+            # the request coroutine answers with a 500 (or aborts) once it sees the end
+            if not gone.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop)
+            raise
+
+    @staticmethod
+    async def _send_error(send, status, message):
+        body = json.dumps({'message': message}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.queue_size)
+        # set once the response is not read anymore, the worker thread stops producing it
+        gone = threading.Event()
+        future = loop.run_in_executor(
+            self.executor_for(scope['path']), self._serve, self._environ(scope, body), loop, queue, gone)
+
+        started = False
+        try:
+            while True:
+                # the first item also waits for a free thread of the executor
+                item = await asyncio.wait_for(queue.get(), self.timeout)
+                if item is None:
+                    break
+                if not started:
+                    status, headers = item
+                    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+                    started = True
+                else:
+                    # streamed responses (ndjson) are passed on chunk by chunk
+                    await send({'type': 'http.response.body', 'body': item, 'more_body': True})
+        except asyncio.TimeoutError:
+            # drops the request if it is still queued, a running worker thread may still be stuck
+            # in libvirt, but its executor stays bounded
+            future.cancel()
+            app.logger.warning('%s %s timed out after %ss', scope['method'], scope['path'], self.timeout)
+            if not started:
+                await self._send_error(send, 504, 'Gateway Timeout')
+                return
+            # the response is incomplete, the server has to abort the connection instead of ending the body
+            raise
+        finally:
+            gone.set()
+            # wakes up a worker blocked on the full queue, it sees gone and stops
+            while not queue.empty():
+                queue.get_nowait()
+
+        if not started:
+            # the app failed before starting the response
+            try:
+                await future
+            except Exception as err:
+                app.logger.exception('%s %s failed: %s', scope['method'], scope['path'], err)
+            await self._send_error(send, 500, 'Internal Server Error')
+            return
+        try:
+            await future
+        except Exception as err:
+            # the app failed while streaming, the truncated body must not look complete
+            app.logger.exception('%s %s failed: %s', scope['method'], scope['path'], err)
+            raise
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+application = cvmASGIApp(
+    app.wsgi_app,
+    '/cmpvirtmgr_api',
+    app.config.get('ASGI_HOST_WORKERS', 4),
+    app.config.get('ASGI_SHARED_WORKERS', 32),
+    app.config.get('ASGI_TIMEOUT', 30),
+    app.config.get('ASGI_MAX_HOSTS', 256),
+    app.config.get('ASGI_QUEUE_SIZE', 16)
+)
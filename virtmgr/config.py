@@ -21,6 +21,79 @@ class BasicConfig(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     RESTFUL_JSON = {'ensure_ascii': False}
 
+    # liveness probing of all servers
+    SERVER_PROBE_CONCURRENCY = 32
+    SERVER_PROBE_TIMEOUT = 5
+    SERVER_PROBE_DEADLINE = 6
+
+    # fleet statistics of GET /servers/stats/, results are cached for a few seconds
+    # the timeout applies per server, counted from the start of its query
+    SERVER_STATS_CONCURRENCY = 32
+    SERVER_STATS_TIMEOUT = 10
+    SERVER_STATS_CACHE_TTL = 5
+
+    # bulk domain power actions, hosts are handled concurrently, domains per host up to the cap
+    BULK_ACTION_HOST_CONCURRENCY = 16
+    BULK_ACTION_PER_HOST = 4
+    BULK_ACTION_TIMEOUT = 120
+
+    # pooled libvirt connections per host, the long lane serves long running operations
+    LIBVIRT_POOL_MIN_SIZE = 0
+    LIBVIRT_POOL_MAX_SIZE = 4
+    LIBVIRT_POOL_IDLE_TIMEOUT = 300
+    LIBVIRT_POOL_CHECKOUT_TIMEOUT = 30
+    LIBVIRT_LONG_POOL_MAX_SIZE = 2
+    LIBVIRT_LONG_POOL_CHECKOUT_TIMEOUT = 600
+    # seconds between closing idle pooled connections and filling the pools up to their min size
+    LIBVIRT_POOL_MAINTENANCE_INTERVAL = 30
+
+    # record latency histograms and errors of libvirt calls per host and method, see /metrics
+    LIBVIRT_METRICS = True
+
+    # seconds until the snapshot index of a host is reloaded, snapshots changed by other
+    # clients emit no libvirt event
+    SNAPSHOT_INDEX_TTL = 60
+
+    # requests taking longer (seconds) are logged to the virtmgr.slow_requests logger (None disables it)
+    SLOW_REQUEST_THRESHOLD = 1.0
+    # share of requests (0-100) whose stacks are sampled every PROFILER_INTERVAL seconds, see /profile/
+    PROFILER_SAMPLE_PERCENT = 0
+    PROFILER_INTERVAL = 0.005
+
+    # open connections to all servers in parallel at startup (opt-in), the timeout applies per server
+    LIBVIRT_WARMUP = False
+    LIBVIRT_WARMUP_CONCURRENCY = 16
+    LIBVIRT_WARMUP_TIMEOUT = 60
+
+    # background sampling of domain cpu/memory/disk/network counters (0 disables it)
+    # memory is bounded to capacity samples per domain and max_domains domains
+    DOMAIN_SAMPLER_INTERVAL = 10
+    DOMAIN_SAMPLER_CAPACITY = 120
+    DOMAIN_SAMPLER_MAX_DOMAINS = 10000
+
+    # asynchronous jobs for long running hypervisor operations (0 workers disables them)
+    JOB_WORKERS = 8
+    JOB_HOST_CONCURRENCY = 2
+    JOB_TIMEOUT = 3600
+
+    # background host monitor, probe interval in seconds (0 disables it)
+    HOST_MONITOR_INTERVAL = 10
+
+    # ASGI mode (virtmgr.asgi), threads per server for routes talking to its hypervisor,
+    # threads shared by database only and fleet wide routes, seconds until a 504 is returned,
+    # servers with an own executor (least recently used ones are dropped) and chunks buffered per response
+    ASGI_HOST_WORKERS = 4
+    ASGI_SHARED_WORKERS = 32
+    ASGI_TIMEOUT = 30
+    ASGI_MAX_HOSTS = 256
+    ASGI_QUEUE_SIZE = 16
+
+    # background rescan of the storage pools of connected hosts, at most once per pool
+    # and interval in seconds (0 disables it), pool events keep the index current in between
+    STORAGE_REFRESH_INTERVAL = 300
+    SERVER_STORAGE_CONCURRENCY = 32
+    SERVER_STORAGE_TIMEOUT = 10
+
 
 class DevelopmentConfig(BasicConfig):
 
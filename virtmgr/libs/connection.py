@@ -1,17 +1,69 @@
+import concurrent.futures
 import libvirt
+import os
 import threading
 import socket
+import time
+import types
 
 from virtmgr.libs import util
+from virtmgr.libs import volume
 
 from libvirt import libvirtError
 
-from virtmgr.libs.rwlock import ReadWriteLock
+from virtmgr.libs.inventory import (cvmDomainInventory, cvmGenerations, cvmIndexRefresher, cvmNodeDeviceIndex,
+                                    cvmSnapshotIndex, cvmStorageIndex)
+from virtmgr.libs.metrics import cvmInstrumentedConnection, transport_metrics
+from virtmgr.libs.pool import LANE_LONG, LANE_SHORT, cvmConnectionPool
+from virtmgr.libs.profile import cvmHostProfileCache
 from virtmgr import app
 
 
+# pick the fastest transport which works, see cvmConnection.transport_candidates
+CONN_AUTO = 0
 CONN_TCP = 1
+CONN_SSH = 2
+CONN_TLS = 3
+# local qemu:///system over the unix socket, for virtmgr running on the hypervisor itself
+CONN_SOCKET = 4
+# libvirt test driver, the host is either 'default' or the path of a test driver xml file
+CONN_TEST = 9
+
+TRANSPORT_NAMES = {
+    CONN_TCP: 'tcp',
+    CONN_SSH: 'ssh',
+    CONN_TLS: 'tls',
+    CONN_SOCKET: 'socket',
+    CONN_TEST: 'test',
+}
+
 TCP_PORT = 16509
+TLS_PORT = 16514
+SSH_PORT = 22
+LIBVIRT_SOCKET = '/var/run/libvirt/libvirt-sock'
+
+# remote transports of CONN_AUTO from the cheapest to the most expensive one
+AUTO_TRANSPORTS = (CONN_TCP, CONN_TLS, CONN_SSH)
+TRANSPORT_PORTS = {CONN_TCP: TCP_PORT, CONN_TLS: TLS_PORT, CONN_SSH: SSH_PORT}
+# seconds to wait for the ports of the remote transports before a CONN_AUTO connect
+AUTO_PROBE_TIMEOUT = 3
+
+# stat groups fetched for plain domain listings, block and net counters
+# are expensive and have to be asked for explicitly
+DOMAIN_STATS_BASIC = (libvirt.VIR_DOMAIN_STATS_STATE |
+                      libvirt.VIR_DOMAIN_STATS_BALLOON |
+                      libvirt.VIR_DOMAIN_STATS_VCPU)
+
+
+# power actions of bulk_domain_action
+DOMAIN_ACTIONS = {
+    'start': lambda dom: dom.create(),
+    'shutdown': lambda dom: dom.shutdown(),
+    'destroy': lambda dom: dom.destroy(),
+    'reboot': lambda dom: dom.reboot(0),
+    'suspend': lambda dom: dom.suspend(),
+    'resume': lambda dom: dom.resume(),
+}
 
 
 class cvmEventLoop(threading.Thread):
@@ -38,40 +90,108 @@ class cvmEventLoop(threading.Thread):
             libvirt.virEventRunDefaultImpl()
 
 
+def is_local_host(host):
+    """returns True if host names the machine we are running on"""
+    if host in ('localhost', '127.0.0.1', '::1', socket.gethostname(), socket.getfqdn()):
+        return True
+    try:
+        return socket.gethostbyname(host) == socket.gethostbyname(socket.gethostname())
+    except socket.error:
+        return False
+
+
+def probe_transports(host, transports, timeout=AUTO_PROBE_TIMEOUT):
+    """
+    opens a tcp connection to the port of every given remote transport at once,
+    returns a dict mapping each transport to its connect latency in seconds (None if unreachable)
+    """
+    # ssh hosts may be given as user@host
+    hostname = host.rsplit('@', 1)[-1]
+
+    def probe(transport):
+        start = time.perf_counter()
+        try:
+            socket.create_connection((hostname, TRANSPORT_PORTS[transport]), timeout).close()
+        except (socket.error, OSError):
+            return None
+        latency = time.perf_counter() - start
+        transport_metrics.observe(TRANSPORT_NAMES[transport], 'probe', latency)
+        return latency
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(transports)) as executor:
+        return dict(zip(transports, executor.map(probe, transports)))
+
+
 class cvmConnection(object):
     """
     class representing a single connection stored in the Connection Manager
     # to-do: may also need some locking to ensure to not connect simultaniously in 2 threads
     """
 
-    def __init__(self, host, conn):
+    def __init__(self, host, conn, watch=True, lazy=False):
         """
-        Sets all class attributes and tries to open the connection
+        Sets all class attributes and tries to open the connection (unless lazy)
+        only watched connections subscribe to events and keep an inventory,
+        pooled connections do not
         """
         # connection lock is used to lock all changes to the connection state attributes
         # (connection and last_error)
         self.connection_state_lock = threading.Lock()
         self.connection = None
         self.last_error = None
+        # successful connects after the first one
+        self.reconnect_count = 0
+        self._connected_once = False
+        # metrics proxy of the current connection, see instrumented
+        self._instrumented = None
 
         # credentials
         self.host = host
         self.type = conn
+        # transport of the current (or last) connection, differs from type for CONN_AUTO
+        self.transport = conn if conn != CONN_AUTO else None
+
+        # event fed indexes of the host, resynced on every (re)connect
+        # one refresher thread per host, a hung host does not hold up the indexes of others
+        refresher = cvmIndexRefresher('index refresher {}'.format(host)) if watch else None
+        self.inventory = cvmDomainInventory(refresher) if watch else None
+        self.generations = cvmGenerations(refresher) if watch else None
+        self.snapshots = cvmSnapshotIndex(refresher, connection_manager.snapshot_ttl) if watch else None
+        self.node_devices = cvmNodeDeviceIndex(refresher=refresher) if watch else None
+        self.storage = cvmStorageIndex(refresher) if watch else None
+        self.indexes = [self.inventory, self.generations, self.snapshots, self.node_devices,
+                        self.storage] if watch else []
+        # capabilities and other host data, loaded on first use after every (re)connect
+        self.profile_cache = cvmHostProfileCache()
 
         # connect
-        self.connect()
+        if not lazy:
+            self.connect()
 
     def connect(self):
         self.connection_state_lock.acquire()
         try:
             # recheck if we have a connection (it may have been
             if not self.connected:
-                if self.type == CONN_TCP:
-                    self.__connect_tcp()
-                else:
-                    raise ValueError('"{type}" is not a valid connection type'.format(type=self.type))
+                # libvirtd may have been restarted (upgraded) while we were disconnected
+                self.profile_cache.invalidate()
+                for transport in self.transport_candidates():
+                    start = time.perf_counter()
+                    if transport == CONN_TCP:
+                        self.__connect_tcp()
+                    else:
+                        self.__connect_uri(self.uri(transport))
+                    transport_metrics.observe(
+                        TRANSPORT_NAMES[transport], 'connect', time.perf_counter() - start, self.connection is None)
+                    if self.connection is not None:
+                        self.transport = transport
+                        break
 
                 if self.connected:
+                    if self._connected_once:
+                        self.reconnect_count += 1
+                    self._connected_once = True
+
                     # do some preprocessing of the connection:
                     #     * set keep alive interval
                     #     * set connection close/fail handler
@@ -86,9 +206,86 @@ class cvmConnection(object):
                     except libvirtError as e:
                         # hypervisor driver does not seem to support persistent connections
                         self.last_error = str(e)
+
+                    # events may have been missed while we were disconnected, the indexes
+                    # only register their callbacks here and resync in the background
+                    for index in self.indexes:
+                        try:
+                            index.attach(self.connection)
+                        except libvirtError as e:
+                            self.last_error = str(e)
         finally:
             self.connection_state_lock.release()
 
+    def transport_candidates(self):
+        """
+        returns the transports to try in order: the one of the last successful connect if it
+        still answers, the local socket, then the remote transports by measured latency
+        the remote ports are probed at once, unreachable ones are not tried
+        raises ValueError for unknown connection types
+        """
+        if self.type in TRANSPORT_NAMES:
+            return [self.type]
+        if self.type != CONN_AUTO:
+            raise ValueError('"{type}" is not a valid connection type'.format(type=self.type))
+
+        latencies = probe_transports(self.host, AUTO_TRANSPORTS)
+        remote = sorted((transport for transport in AUTO_TRANSPORTS if latencies[transport] is not None),
+                        key=latencies.get)
+        if not remote:
+            # let libvirt report why the host cannot be reached
+            remote = list(AUTO_TRANSPORTS)
+
+        candidates = []
+        if self.transport is not None and (self.transport in remote or self.transport not in AUTO_TRANSPORTS):
+            candidates.append(self.transport)
+        if is_local_host(self.host) and os.path.exists(LIBVIRT_SOCKET):
+            candidates.append(CONN_SOCKET)
+        candidates.extend(remote)
+        # keep the first occurrence of every transport
+        return [transport for index, transport in enumerate(candidates) if transport not in candidates[:index]]
+
+    @property
+    def transport_name(self):
+        return TRANSPORT_NAMES.get(self.transport, 'none')
+
+    def uri(self, transport=None):
+        transport = transport if transport is not None else self.transport
+        if transport == CONN_SOCKET:
+            return 'qemu:///system'
+        if transport == CONN_TEST:
+            if self.host == 'default':
+                return 'test:///default'
+            return 'test://{}'.format(os.path.abspath(self.host))
+        if transport == CONN_SSH:
+            return 'qemu+ssh://{}/system?no_tty=1'.format(self.host)
+        return 'qemu+{}://{}/system'.format(TRANSPORT_NAMES.get(transport, 'invalid_type'), self.host)
+
+    @property
+    def instrumented(self):
+        """
+        the connection wrapped in a proxy recording call latencies and errors,
+        the plain connection if instrumentation is disabled (None if not connected)
+        """
+        connection = self.connection
+        if connection is None or not connection_manager.instrument:
+            return connection
+        instrumented = self._instrumented
+        if instrumented is None or instrumented.wrapped is not connection:
+            instrumented = self._instrumented = cvmInstrumentedConnection(
+                connection, self.host, self.transport_name)
+        return instrumented
+
+    def get_profile(self):
+        """
+        returns the cached cvmHostProfile of the connected host
+        raises libvirtError if not connected or loading fails
+        """
+        connection = self.connection
+        if connection is None:
+            raise libvirtError(self.last_error or 'not connected')
+        return self.profile_cache.get(connection)
+
     @property
     def connected(self):
         try:
@@ -114,6 +311,10 @@ class cvmConnection(object):
                 else:
                     self.last_error = 'connection closed: Unknown error'
 
+            for index in self.indexes:
+                index.detach()
+            self.profile_cache.invalidate()
+
             # prevent other threads from using the connection (in the future)
             self.connection = None
         finally:
@@ -155,12 +356,25 @@ class cvmConnection(object):
                 self.last_error = 'Connection Failed: ' + str(e)
                 self.connection = None
 
+    def __connect_uri(self, uri):
+        # ssh, tls and socket connections authenticate outside of libvirt (keys, certificates,
+        # socket permissions), the ssh session stays open as long as the connection does
+        try:
+            self.connection = libvirt.open(uri)
+            self.last_error = None
+        except libvirtError as e:
+            self.last_error = 'Connection Failed: ' + str(e)
+            self.connection = None
+
     def close(self):
         """
         closes the connection (if it is active)
         """
         self.connection_state_lock.acquire()
         try:
+            for index in self.indexes:
+                index.detach()
+            self.profile_cache.invalidate()
             if self.connected:
                 try:
                     # to-do: handle errors?
@@ -182,30 +396,48 @@ class cvmConnection(object):
                 pass
 
     def __str__(self):
-        if self.type == CONN_TCP:
-            type_str = 'tcp'
-        else:
-            type_str = 'invalid_type'
-
-        return 'qemu+{}://{}/system'.format(type_str, self.host)
+        if self.transport is None:
+            return 'auto://{}'.format(self.host)
+        return self.uri()
 
     def __repr__(self):
         return '<cvmConnection {connection_str}>'.format(connection_str=str(self))
 
 
 class cvmConnectionManager(object):
-    def __init__(self, keepalive_interval=5, keepalive_count=5):
+    def __init__(self, keepalive_interval=5, keepalive_count=5, pool_settings=None, instrument=True,
+                 snapshot_ttl=60):
         self.keepalive_interval = keepalive_interval
         self.keepalive_count = keepalive_count
 
-        # connection dict
-        # maps hostnames to a list of connection objects for this hostname
+        # seconds until the snapshot index of a host is resynced, see cvmSnapshotIndex
+        self.snapshot_ttl = snapshot_ttl
+
+        # hand out connections recording call metrics, see cvmInstrumentedConnection
+        self.instrument = instrument
+
+        # per lane keyword arguments of cvmConnectionPool
+        self.pool_settings = pool_settings or {}
+
+        # result of the last warm_up call
+        self.warmup_report = None
+
+        # connection mapping
+        # maps (hostname, type) to the connection object for this hostname
         # atm it is possible to create more than one connection per hostname
-        # with different logins or auth methods
+        # with different auth methods
         # connections are shared between all threads, see:
         #     http://wiki.libvirt.org/page/FAQ#Is_libvirt_thread_safe.3F
-        self._connections = dict()
-        self._connections_lock = ReadWriteLock()
+        # the mapping is immutable and replaced as a whole when a connection is added
+        # (copy-on-write), so lookups need no lock, only writers are serialized
+        self._connections = types.MappingProxyType({})
+        self._connections_lock = threading.Lock()
+
+        # extra pooled connections, maps (hostname, type, lane) to a cvmConnectionPool
+        # the shared connection above keeps serving events and cheap calls
+        # copy-on-write as well
+        self._pools = types.MappingProxyType({})
+        self._pools_lock = threading.Lock()
 
         # start event loop to handle keepalive requests and other events
         self._event_loop = cvmEventLoop()
@@ -216,22 +448,11 @@ class cvmConnectionManager(object):
         search the connection dict for a connection with the given credentials
         if it does not exist return None
         """
-        self._connections_lock.acquireRead()
-        try:
-            if host in self._connections:
-                connections = self._connections[host]
-
-                for connection in connections:
-                    if connection.type == conn:
-                        return connection
-        finally:
-            self._connections_lock.release()
+        return self._connections.get((host, conn))
 
-        return None
-
-    def get_connection(self, host, conn):
+    def _get_cvm_connection(self, host, conn):
         """
-        returns a connection object (as returned by the libvirt.open* methods) for the given host and credentials
+        returns the connected cvmConnection for the given host and credentials
         raises libvirtError if (re)connecting fails
         """
         # force all string values to unicode
@@ -240,43 +461,196 @@ class cvmConnectionManager(object):
         connection = self._search_connection(host, conn)
 
         if connection is None:
-            self._connections_lock.acquireWrite()
-            try:
+            with self._connections_lock:
                 # we have to search for the connection again after aquireing the write lock
                 # as the thread previously holding the write lock may have already added our connection
                 connection = self._search_connection(host, conn)
                 if connection is None:
                     # create a new connection if a matching connection does not already exist
-                    connection = cvmConnection(host, conn)
+                    # it is opened after releasing the lock, so a slow host does not hold up others
+                    connection = cvmConnection(host, conn, lazy=True)
 
-                    # add new connection to connection dict
-                    if host in self._connections:
-                        self._connections[host].append(connection)
-                    else:
-                        self._connections[host] = [connection]
-            finally:
-                self._connections_lock.release()
+                    # publish a new mapping including the new connection
+                    connections = dict(self._connections)
+                    connections[(host, conn)] = connection
+                    self._connections = types.MappingProxyType(connections)
 
-        elif not connection.connected:
-            # try to (re-)connect if connection is closed
+        if not connection.connected:
+            # try to (re-)connect if connection is closed (or not opened yet)
             connection.connect()
 
         if connection.connected:
-            # return libvirt connection object
-            return connection.connection
+            return connection
         else:
             # raise libvirt error
             raise libvirtError(connection.last_error)
 
-    def host_is_up(self, hostname):
+    def get_connection(self, host, conn):
+        """
+        returns a connection object (as returned by the libvirt.open* methods) for the given host and credentials
+        raises libvirtError if (re)connecting fails
+        """
+        return self._get_cvm_connection(host, conn).instrumented
+
+    def get_inventory(self, host, conn):
+        """
+        returns the domain inventory of the given host, (re)connecting if needed
+        raises libvirtError if (re)connecting fails
+        """
+        return self._get_cvm_connection(host, conn).inventory
+
+    def get_storage_index(self, host, conn):
+        """
+        returns the storage pool index of the given host, (re)connecting if needed
+        raises libvirtError if (re)connecting fails
+        """
+        return self._get_cvm_connection(host, conn).storage
+
+    def get_node_device_index(self, host, conn):
+        """
+        returns the node device index of the given host, (re)connecting if needed
+        raises libvirtError if (re)connecting fails
+        """
+        return self._get_cvm_connection(host, conn).node_devices
+
+    def get_host_profile(self, host, conn):
+        """
+        returns the cached cvmHostProfile of the given host, (re)connecting if needed
+        raises libvirtError if (re)connecting or loading the profile fails
+        """
+        return self._get_cvm_connection(host, conn).get_profile()
+
+    def get_snapshot_index(self, host, conn):
+        """
+        returns the snapshot index of the given host, (re)connecting if needed
+        raises libvirtError if (re)connecting fails
+        """
+        return self._get_cvm_connection(host, conn).snapshots
+
+    def get_generation(self, host, conn, kind):
+        """
+        returns the current generation of the given kind of resources of the host
+        without (re)connecting, None if it is not known (not connected)
+        """
+        connection = self._search_connection(str(host), conn)
+        if connection is None or connection.generations is None:
+            return None
+        if not connection.connected or not connection.generations.synced:
+            return None
+        return connection.generations.get(kind)
+
+    def get_pool(self, host, conn, lane=LANE_SHORT):
+        """
+        returns the connection pool of the given host and lane, creating it if needed
+        """
+        key = (str(host), conn, lane)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = cvmConnectionPool(
+                        lambda: cvmConnection(key[0], conn, watch=False), **self.pool_settings.get(lane, {}))
+                    pools = dict(self._pools)
+                    pools[key] = pool
+                    self._pools = types.MappingProxyType(pools)
+        return pool
+
+    def lease(self, host, conn, lane=LANE_SHORT, timeout=None):
+        """
+        context manager yielding a libvirt connection object checked out of the host's pool
+        raises libvirtError if no connection becomes available or connecting fails
+        """
+        return self.get_pool(host, conn, lane).connection(timeout)
+
+    def pools(self):
+        """
+        returns all connection pools
+        """
+        return list(self._pools.values())
+
+    def warm_up(self, targets, max_workers=16, timeout=60):
+        """
+        opens the shared connections to all given (hostname, type) targets in parallel
+        returns a dict mapping each target to its warm-up time in seconds and error (None on success),
+        every target gets timeout seconds counted from the start of its own connect, all targets
+        are attempted, the ones not connected in time keep connecting in the background
+        """
+        def connect(target):
+            start = time.time()
+            try:
+                self._get_cvm_connection(*target)
+                error = None
+            except libvirtError as err:
+                error = str(err)
+            return time.time() - start, error
+
+        report = {}
+        results = util.map_concurrently(connect, set(targets), max_workers, item_timeout=timeout)
+        for target, (result, error) in results.items():
+            if error is not None:
+                report[target] = {'elapsed': None, 'error': str(error)}
+            else:
+                report[target] = {'elapsed': result[0], 'error': result[1]}
+        self.warmup_report = report
+        return report
+
+    def connections(self):
+        """
+        returns all shared cvmConnections, connected or not
+        """
+        return list(self._connections.values())
+
+    def connected_targets(self):
+        """
+        returns (hostname, type) of all shared connections which are currently connected
+        """
+        return [key for key, connection in self._connections.items() if connection.connected]
+
+    def is_connected(self, host, conn):
+        """
+        returns the keepalive state of an existing connection without (re)connecting,
+        None if there never was a connection to the given host
+        """
+        connection = self._search_connection(str(host), conn)
+        return connection.connected if connection is not None else None
+
+    def host_is_up(self, hostname, timeout=5, conn=CONN_TCP):
         """
         returns True if the given host is up and we are able to establish
         a connection using the given credentials.
         """
+        if conn == CONN_TEST:
+            return True
+        if conn == CONN_SOCKET:
+            return True if os.path.exists(LIBVIRT_SOCKET) else IOError('{} does not exist'.format(LIBVIRT_SOCKET))
+        if conn == CONN_AUTO:
+            # the host is up if any remote transport answers, all of them are probed at once
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(AUTO_TRANSPORTS))
+            try:
+                futures = dict((executor.submit(self.host_is_up, hostname, timeout, transport), transport)
+                               for transport in AUTO_TRANSPORTS)
+                errors = {}
+                for future in concurrent.futures.as_completed(futures):
+                    result = future.result()
+                    if result is True:
+                        return True
+                    errors[futures[future]] = result
+            finally:
+                # do not wait for the probes still running, they end with their socket timeout
+                executor.shutdown(wait=False)
+            # report the error of the transport the connection settled on, the first one until then
+            connection = self._search_connection(str(hostname), conn)
+            transport = connection.transport if connection is not None and connection.transport else None
+            return errors.get(transport, errors[AUTO_TRANSPORTS[0]])
+
+        port = TRANSPORT_PORTS.get(conn, TCP_PORT)
+        # ssh hosts may be given as user@host
+        hostname = hostname.rsplit('@', 1)[-1]
         try:
             socket_host = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            socket_host.settimeout(5)
-            socket_host.connect((hostname, TCP_PORT))
+            socket_host.settimeout(timeout)
+            socket_host.connect((hostname, port))
             socket_host.close()
             return True
         except Exception as err:
@@ -285,25 +659,64 @@ class cvmConnectionManager(object):
 
 connection_manager = cvmConnectionManager(
     app.config['LIBVIRT_KEEPALIVE_INTERVAL'] if hasattr(app.config, 'LIBVIRT_KEEPALIVE_INTERVAL') else 5,
-    app.config['LIBVIRT_KEEPALIVE_COUNT'] if hasattr(app.config, 'LIBVIRT_KEEPALIVE_COUNT') else 5
+    app.config['LIBVIRT_KEEPALIVE_COUNT'] if hasattr(app.config, 'LIBVIRT_KEEPALIVE_COUNT') else 5,
+    {
+        LANE_SHORT: {
+            'min_size': app.config.get('LIBVIRT_POOL_MIN_SIZE', 0),
+            'max_size': app.config.get('LIBVIRT_POOL_MAX_SIZE', 4),
+            'idle_timeout': app.config.get('LIBVIRT_POOL_IDLE_TIMEOUT', 300),
+            'checkout_timeout': app.config.get('LIBVIRT_POOL_CHECKOUT_TIMEOUT', 30),
+        },
+        LANE_LONG: {
+            'min_size': 0,
+            'max_size': app.config.get('LIBVIRT_LONG_POOL_MAX_SIZE', 2),
+            'idle_timeout': app.config.get('LIBVIRT_POOL_IDLE_TIMEOUT', 300),
+            'checkout_timeout': app.config.get('LIBVIRT_LONG_POOL_CHECKOUT_TIMEOUT', 600),
+        },
+    },
+    app.config.get('LIBVIRT_METRICS', True),
+    app.config.get('SNAPSHOT_INDEX_TTL', 60)
 )
 
 
 class cvmConnect(object):
-    def __init__(self, host, conn):
+    def __init__(self, host, conn, lane=None):
         self.host = host
         self.conn = conn
 
+        # without a lane the shared connection of the host is used,
+        # otherwise a connection is checked out of the lane's pool until close()
+        self._pool = None
+        self._leased = None
+
         # get connection from connection manager
-        self.cvm = connection_manager.get_connection(host, conn)
+        if lane is None:
+            self.cvm = connection_manager.get_connection(host, conn)
+        else:
+            self._pool = connection_manager.get_pool(host, conn, lane)
+            self._leased = self._pool.checkout()
+            self.cvm = self._leased.instrumented
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_host_profile(self):
+        """Return the cached, pre parsed host profile"""
+        return connection_manager.get_host_profile(self.host, self.conn)
 
     def get_cap_xml(self):
         """Return xml capabilities"""
-        return self.cvm.getCapabilities()
+        return self.get_host_profile().cap_xml
 
     def is_kvm_supported(self):
         """Return KVM capabilities."""
-        return util.is_kvm_available(self.get_cap_xml())
+        return self.get_host_profile().kvm
+
+    def get_max_vcpus(self):
+        return self.get_host_profile().max_vcpus
 
     def get_storages(self):
         storages = []
@@ -313,6 +726,19 @@ class cvmConnect(object):
             storages.append(pool)
         return storages
 
+    def get_storage_pools(self):
+        """Return all storage pools with capacity and volumes (from the index once it is synced)"""
+        index = connection_manager.get_storage_index(self.host, self.conn)
+        if index.synced:
+            return index.pools()
+        pools = cvmStorageIndex.load_pools(self.cvm)
+        return [pools[name] for name in sorted(pools)]
+
+    def get_storage_capacity(self):
+        """Return the summed capacity of the active storage pools, None if the index is not synced yet"""
+        index = connection_manager.get_storage_index(self.host, self.conn)
+        return index.capacity() if index.synced else None
+
     def get_networks(self):
         virtnet = []
         for net in self.cvm.listNetworks():
@@ -344,6 +770,20 @@ class cvmConnect(object):
     def get_volume_by_path(self, path):
         return self.cvm.storageVolLookupByPath(path)
 
+    def upload_volume(self, path, src_path, sparse=True, progress=None):
+        """
+        uploads a local image file into the volume with the given path over this connection
+        (no ssh credentials needed), use a cvmConnect of the long lane for big images
+        progress(sent bytes, size) is called for every sent block
+        """
+        return volume.upload(self.cvm, self.get_volume_by_path(path), src_path, sparse, progress)
+
+    def download_volume(self, path, dst_path, sparse=True):
+        """
+        downloads the volume with the given path into a local file over this connection
+        """
+        return volume.download(self.cvm, self.get_volume_by_path(path), dst_path, sparse)
+
     def get_network(self, net):
         return self.cvm.networkLookupByName(net)
 
@@ -351,6 +791,10 @@ class cvmConnect(object):
         return self.cvm.lookupByName(name)
 
     def get_instances(self):
+        inventory = connection_manager.get_inventory(self.host, self.conn)
+        if inventory.synced:
+            return inventory.names()
+
         instances = []
         for inst_id in self.cvm.listDomainsID():
             dom = self.cvm.lookupByID(int(inst_id))
@@ -359,44 +803,108 @@ class cvmConnect(object):
             instances.append(name)
         return instances
 
+    def get_domains(self):
+        """
+        returns a list of dicts (name, uuid, id, state) of all domains sorted by name
+        """
+        inventory = connection_manager.get_inventory(self.host, self.conn)
+        if inventory.synced:
+            domains = inventory.domains()
+        else:
+            domains = [{'name': dom.name(), 'uuid': dom.UUIDString(), 'id': dom.ID(), 'state': dom.state()[0]}
+                       for dom in self.cvm.listAllDomains(0)]
+        return sorted(domains, key=lambda dom: dom['name'])
+
+    def bulk_domain_action(self, names, action, parallelism=4, timeout=None):
+        """
+        runs the power action on all given domains, at most parallelism at a time
+        the domains are resolved with a single listAllDomains call
+        returns a dict mapping each name to None on success or the error message
+        """
+        run_action = DOMAIN_ACTIONS[action]
+        domains = dict((dom.name(), dom) for dom in self.cvm.listAllDomains(0))
+
+        def run(name):
+            if name not in domains:
+                raise libvirtError('Domain {} not found'.format(name))
+            run_action(domains[name])
+
+        results = util.map_concurrently(run, names, parallelism, timeout)
+        return dict((name, str(error) if error is not None else None) for name, (_, error) in results.items())
+
     def get_snapshots(self):
-        instance = []
-        for snap_id in self.cvm.listDomainsID():
-            dom = self.cvm.lookupByID(int(snap_id))
-            if dom.snapshotNum(0) != 0:
-                instance.append(dom.name())
-        for name in self.cvm.listDefinedDomains():
-            dom = self.cvm.lookupByName(name)
-            if dom.snapshotNum(0) != 0:
-                instance.append(dom.name())
-        return instance
+        index = connection_manager.get_snapshot_index(self.host, self.conn)
+        if index.fresh:
+            return index.domains()
+
+        # not synced yet, a single rpc instead of snapshotNum() for every domain
+        return [dom.name() for dom in self.cvm.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_HAS_SNAPSHOT)]
 
     def get_net_device(self):
+        index = connection_manager.get_node_device_index(self.host, self.conn)
+        if index.synced:
+            return [dev['interface'] for dev in index.by_capability('net')]
+
+        # not synced yet, let libvirtd filter the net devices
         netdevice = []
-        for dev in self.cvm.listAllDevices(0):
-            xml = dev.XMLDesc(0)
-            dev_type = util.get_xml_path(xml, '/device/capability/@type')
-            if dev_type == 'net':
-                netdevice.append(util.get_xml_path(xml, '/device/capability/interface'))
+        for dev in self.cvm.listAllDevices(libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_NET):
+            netdevice.append(util.get_xml_path(dev.XMLDesc(0), '/device/capability/interface'))
         return netdevice
 
+    def get_node_devices(self, capability):
+        """Return the indexed node devices with the given capability type"""
+        return connection_manager.get_node_device_index(self.host, self.conn).by_capability(capability)
+
+    def get_node_stats(self):
+        """
+        returns node info, free memory, cpu time counters and domain counts of the host
+        """
+        info = self.cvm.getInfo()
+
+        inventory = connection_manager.get_inventory(self.host, self.conn)
+        if inventory.synced:
+            total = len(inventory)
+            active = len([dom for dom in inventory.domains() if dom['id'] != -1])
+        else:
+            active = self.cvm.numOfDomains()
+            total = active + self.cvm.numOfDefinedDomains()
+
+        return {
+            'cpu_model': info[0],
+            'memory': info[1] * 1048576,
+            'free_memory': self.cvm.getFreeMemory(),
+            'cpus': info[2],
+            'mhz': info[3],
+            'numa_nodes': info[4],
+            'sockets': info[5],
+            'cores': info[6],
+            'threads': info[7],
+            'cpu_stats': self.cvm.getCPUStats(libvirt.VIR_NODE_CPU_STATS_ALL_CPUS, 0),
+            'domains': {'total': total, 'active': active, 'inactive': total - active},
+        }
+
+    def get_domain_stats(self, stats=DOMAIN_STATS_BASIC, flags=0):
+        """
+        returns a dict mapping every domain name to its stats dict,
+        fetched in a single getAllDomainStats call for the given stat groups
+        """
+        return dict((dom.name(), dom_stats) for dom, dom_stats in self.cvm.getAllDomainStats(stats, flags))
+
     def get_host_instances(self):
         vname = {}
         memory = self.cvm.getInfo()[1] * 1048576
-        for name in self.get_instances():
-            dom = self.get_instance(name)
-            mem = util.get_xml_path(dom.XMLDesc(0), "/domain/currentMemory")
-            mem = int(mem) * 1024
+        for name, stats in self.get_domain_stats(DOMAIN_STATS_BASIC).items():
+            mem = stats.get('balloon.current', 0) * 1024
             mem_usage = (mem * 100) / memory
-            cur_vcpu = util.get_xml_path(dom.XMLDesc(0), "/domain/vcpu/@current")
-            if cur_vcpu:
-                vcpu = cur_vcpu
-            else:
-                vcpu = util.get_xml_path(dom.XMLDesc(0), "/domain/vcpu")
-            vname[dom.name()] = (dom.info()[0], vcpu, mem, mem_usage)
+            vcpu = stats.get('vcpu.current', stats.get('vcpu.maximum', 0))
+            vname[name] = (stats.get('state.state', 0), vcpu, mem, mem_usage)
         return vname
 
     def close(self):
-        """Close connection"""
-        # to-do: do not close connection ;)
-        self.cvm.close()
+        """Release connection"""
+        # the libvirt connection is shared and kept open by the connection manager,
+        # closing it here would drop it (and its inventory) for every other request
+        if self._leased is not None:
+            self._pool.checkin(self._leased)
+            self._leased = None
+        self.cvm = None
@@ -0,0 +1,758 @@
+import queue
+import threading
+import time
+
+import libvirt
+
+from libvirt import libvirtError
+
+from virtmgr.libs import util
+
+
+class cvmIndexRefresher(threading.Thread):
+    """
+    reloads single entries and does the full resyncs of indexes in the background,
+    event callbacks must not block the event loop thread with rpc calls of their own
+    and (re)connects must not wait for the indexes to load
+    there is one per host (see cvmConnection), a hung hypervisor only stalls its own indexes
+    """
+
+    def __init__(self, name='index refresher'):
+        super(cvmIndexRefresher, self).__init__(name=name)
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+
+    def schedule(self, func, *args):
+        if not self.is_alive():
+            with self._start_lock:
+                if not self.is_alive():
+                    self.start()
+        self._queue.put((func, args))
+
+    def run(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except libvirtError:
+                # the entry gets reloaded by the next event or resync
+                pass
+
+
+class cvmEventIndex(object):
+    """
+    base class for in-memory indexes of libvirt objects of a single host
+    the index is seeded once per (re)connect and then kept current by libvirt
+    event callbacks, which are dispatched on the cvmEventLoop thread
+    """
+
+    def __init__(self, refresher=None, ttl=None):
+        # runs the resyncs and entry reloads, usually shared by the indexes of a host
+        self._refresher = refresher or cvmIndexRefresher()
+        # seconds after which the data counts as expired, for objects whose changes
+        # do not all emit events, None if the events keep the index current
+        self.ttl = ttl
+        self._loaded_at = None
+        self._resync_scheduled = False
+        # the lock guards the indexed data, it is shared by the request threads
+        # (readers) and the event loop thread (writer)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._callback_ids = []
+        # keys scheduled for a background refresh
+        self._pending = set()
+        # changes arriving while a full load runs are queued and applied on top of it
+        self._loading = False
+        self._queued = []
+        self.synced = False
+
+    def attach(self, connection):
+        """
+        binds the index to a freshly opened libvirt connection and schedules a full resync
+        on the refresher thread, events may have been missed while the previous connection
+        was down, readers fall back to direct calls until the index is synced
+        """
+        self.detach()
+        self._connection = connection
+        # register the callbacks before loading, changes during the load are replayed after it
+        self._register_events(connection)
+        self._refresher.schedule(self.resync)
+
+    def detach(self):
+        connection = self._connection
+        self._connection = None
+        self.synced = False
+
+        if connection is not None:
+            for deregister, callback_id in self._callback_ids:
+                try:
+                    deregister(callback_id)
+                except libvirtError:
+                    # the connection is most likely already dead
+                    pass
+        self._callback_ids = []
+
+    def resync(self):
+        connection = self._connection
+        if connection is None:
+            return
+
+        with self._lock:
+            self._loading = True
+            self._queued = []
+            self._resync_scheduled = False
+        loaded_at = time.time()
+        try:
+            data = self._load(connection)
+        except libvirtError:
+            with self._lock:
+                self._loading = False
+                self._queued = []
+            # keep the index marked as unsynced, readers fall back to direct calls
+            self.synced = False
+            return
+
+        with self._lock:
+            if self._connection is not connection:
+                # reconnected (or detached) meanwhile, the data is stale, a newer resync follows
+                self._loading = False
+                self._queued = []
+                return
+            self._replace(data)
+        # replay in order, changes arriving meanwhile are queued behind
+        while True:
+            with self._lock:
+                queued, self._queued = self._queued, []
+                if not queued:
+                    self._loading = False
+                    # only the connection the data was loaded from marks the index synced
+                    if self._connection is connection:
+                        self._loaded_at = loaded_at
+                        self.synced = True
+                    break
+            for func, args in queued:
+                func(*args)
+
+    @property
+    def fresh(self):
+        """
+        whether the index is synced and not expired (see ttl), an expired index
+        schedules a resync, readers fall back to direct calls until it finished
+        """
+        if not self.synced:
+            return False
+        if self.ttl is None or time.time() - self._loaded_at < self.ttl:
+            return True
+        with self._lock:
+            if self._resync_scheduled:
+                return False
+            self._resync_scheduled = True
+        self._refresher.schedule(self.resync)
+        return False
+
+    def _dispatch(self, func, args):
+        with self._lock:
+            if self._loading:
+                self._queued.append((func, args))
+                return
+        func(*args)
+
+    def _callback(self, func):
+        """wraps an event callback, so its changes are not lost to a concurrent full load"""
+        return lambda *args: self._dispatch(func, args)
+
+    def _register(self, deregister, callback_id):
+        self._callback_ids.append((deregister, callback_id))
+
+    def invalidate(self, key):
+        """
+        schedules a background reload of a single entry (e.g. after a change which
+        does not emit an event), readers keep seeing the old entry until then
+        """
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._refresher.schedule(self._refresh, key)
+
+    def _refresh(self, key):
+        with self._lock:
+            self._pending.discard(key)
+        connection = self._connection
+        if connection is None:
+            return
+        entry = self._load_entry(connection, key)
+        self._dispatch(self._apply_entry, (key, entry))
+
+    def _apply_entry(self, key, entry):
+        with self._lock:
+            self._set_entry(key, entry)
+
+    def _load_entry(self, connection, key):
+        """returns the reloaded entry for key, None if it is gone"""
+        raise NotImplementedError
+
+    def _set_entry(self, key, entry):
+        raise NotImplementedError
+
+    def _register_events(self, connection):
+        raise NotImplementedError
+
+    def _load(self, connection):
+        raise NotImplementedError
+
+    def _replace(self, data):
+        raise NotImplementedError
+
+
+DOMAIN_STATE_NOSTATE = libvirt.VIR_DOMAIN_NOSTATE
+DOMAIN_STATE_RUNNING = libvirt.VIR_DOMAIN_RUNNING
+DOMAIN_STATE_PAUSED = libvirt.VIR_DOMAIN_PAUSED
+DOMAIN_STATE_SHUTDOWN = libvirt.VIR_DOMAIN_SHUTDOWN
+DOMAIN_STATE_SHUTOFF = libvirt.VIR_DOMAIN_SHUTOFF
+DOMAIN_STATE_CRASHED = libvirt.VIR_DOMAIN_CRASHED
+DOMAIN_STATE_PMSUSPENDED = libvirt.VIR_DOMAIN_PMSUSPENDED
+
+DOMAIN_STATE_NAMES = {
+    libvirt.VIR_DOMAIN_NOSTATE: 'nostate',
+    libvirt.VIR_DOMAIN_RUNNING: 'running',
+    libvirt.VIR_DOMAIN_BLOCKED: 'blocked',
+    libvirt.VIR_DOMAIN_PAUSED: 'paused',
+    libvirt.VIR_DOMAIN_SHUTDOWN: 'shutdown',
+    libvirt.VIR_DOMAIN_SHUTOFF: 'shutoff',
+    libvirt.VIR_DOMAIN_CRASHED: 'crashed',
+    libvirt.VIR_DOMAIN_PMSUSPENDED: 'pmsuspended',
+}
+
+# maps lifecycle events to the domain state they leave the domain in
+_LIFECYCLE_EVENT_STATES = {
+    libvirt.VIR_DOMAIN_EVENT_STARTED: DOMAIN_STATE_RUNNING,
+    libvirt.VIR_DOMAIN_EVENT_RESUMED: DOMAIN_STATE_RUNNING,
+    libvirt.VIR_DOMAIN_EVENT_SUSPENDED: DOMAIN_STATE_PAUSED,
+    libvirt.VIR_DOMAIN_EVENT_SHUTDOWN: DOMAIN_STATE_SHUTDOWN,
+    libvirt.VIR_DOMAIN_EVENT_STOPPED: DOMAIN_STATE_SHUTOFF,
+    libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: DOMAIN_STATE_PMSUSPENDED,
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: DOMAIN_STATE_CRASHED,
+}
+
+
+class cvmDomainInventory(cvmEventIndex):
+    """
+    per host inventory of all domains (name, uuid, id and state)
+    fed by domain lifecycle events
+    """
+
+    def __init__(self, refresher=None):
+        super(cvmDomainInventory, self).__init__(refresher)
+        self._domains = {}
+
+    def _register_events(self, connection):
+        callback_id = connection.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._callback(self.__lifecycle_callback), None)
+        self._register(connection.domainEventDeregisterAny, callback_id)
+
+    def _load(self, connection):
+        # name, uuid and id are part of the domain object itself, so listing
+        # all domains plus the paused ones is all the rpc we need
+        paused = set(dom.UUIDString() for dom in
+                     connection.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_PAUSED))
+
+        domains = {}
+        for dom in connection.listAllDomains(0):
+            if dom.ID() == -1:
+                state = DOMAIN_STATE_SHUTOFF
+            elif dom.UUIDString() in paused:
+                state = DOMAIN_STATE_PAUSED
+            else:
+                state = DOMAIN_STATE_RUNNING
+            domains[dom.name()] = self._entry(dom, state)
+        return domains
+
+    def _replace(self, data):
+        self._domains = data
+
+    def _load_entry(self, connection, key):
+        try:
+            dom = connection.lookupByName(key)
+            state = dom.state()[0]
+        except libvirtError:
+            # transient domains are gone as soon as they stop
+            return None
+        if state == libvirt.VIR_DOMAIN_BLOCKED:
+            state = DOMAIN_STATE_RUNNING
+        return self._entry(dom, state)
+
+    def _set_entry(self, key, entry):
+        if entry is None:
+            self._domains.pop(key, None)
+        else:
+            self._domains[key] = entry
+
+    @staticmethod
+    def _entry(dom, state):
+        # the id of a stopped event's domain may still be the one it was running with
+        dom_id = -1 if state == DOMAIN_STATE_SHUTOFF else dom.ID()
+        return {'name': dom.name(), 'uuid': dom.UUIDString(), 'id': dom_id, 'state': state}
+
+    def __lifecycle_callback(self, connection, dom, event, detail, opaque=None):
+        name = dom.name()
+
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            with self._lock:
+                self._domains.pop(name, None)
+            return
+
+        with self._lock:
+            state = _LIFECYCLE_EVENT_STATES.get(event)
+            if state is None:
+                # defined: a new domain is shut off, a redefined one keeps its state
+                current = self._domains.get(name)
+                state = current['state'] if current is not None else DOMAIN_STATE_SHUTOFF
+            self._domains[name] = self._entry(dom, state)
+
+        if event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+            # a stopped transient domain is gone, asking libvirtd (rpc) is left to the refresher
+            self.invalidate(name)
+
+    def domains(self):
+        """
+        returns a list of dicts describing every domain, running domains first
+        """
+        with self._lock:
+            domains = list(self._domains.values())
+        return sorted(domains, key=lambda d: (d['id'] == -1, d['id'], d['name']))
+
+    def names(self):
+        return [dom['name'] for dom in self.domains()]
+
+    def get(self, name):
+        with self._lock:
+            dom = self._domains.get(name)
+        return dict(dom) if dom is not None else None
+
+    def __len__(self):
+        return len(self._domains)
+
+
+GEN_DOMAIN = 'domain'
+GEN_NETWORK = 'network'
+
+
+class cvmGenerations(cvmEventIndex):
+    """
+    per host generation counters, one per kind of resource, increased on every
+    relevant libvirt event and on every (re)connect
+    """
+
+    KINDS = (GEN_DOMAIN, GEN_NETWORK)
+
+    def __init__(self, refresher=None):
+        super(cvmGenerations, self).__init__(refresher)
+        self._generations = dict((kind, 0) for kind in self.KINDS)
+
+    def _register_events(self, connection):
+        callback_id = connection.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._callback(self.__domain_callback), None)
+        self._register(connection.domainEventDeregisterAny, callback_id)
+
+        callback_id = connection.networkEventRegisterAny(
+            None, libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE, self._callback(self.__network_callback), None)
+        self._register(connection.networkEventDeregisterAny, callback_id)
+
+    def _load(self, connection):
+        return None
+
+    def _replace(self, data):
+        # events may have been missed, everything is considered changed
+        for kind in self.KINDS:
+            self._generations[kind] += 1
+
+    def bump(self, kind):
+        with self._lock:
+            self._generations[kind] += 1
+
+    def __domain_callback(self, connection, dom, event, detail, opaque=None):
+        self.bump(GEN_DOMAIN)
+
+    def __network_callback(self, connection, net, event, detail, opaque=None):
+        self.bump(GEN_NETWORK)
+
+    def get(self, kind):
+        return self._generations[kind]
+
+
+# lifecycle event details which mean a domain was touched by a snapshot operation
+_SNAPSHOT_EVENT_DETAILS = (
+    (libvirt.VIR_DOMAIN_EVENT_STARTED, libvirt.VIR_DOMAIN_EVENT_STARTED_FROM_SNAPSHOT),
+    (libvirt.VIR_DOMAIN_EVENT_SUSPENDED, libvirt.VIR_DOMAIN_EVENT_SUSPENDED_FROM_SNAPSHOT),
+    (libvirt.VIR_DOMAIN_EVENT_STOPPED, libvirt.VIR_DOMAIN_EVENT_STOPPED_FROM_SNAPSHOT),
+    (libvirt.VIR_DOMAIN_EVENT_DEFINED, libvirt.VIR_DOMAIN_EVENT_DEFINED_FROM_SNAPSHOT),
+)
+
+
+class cvmSnapshotIndex(cvmEventIndex):
+    """
+    per host index of domain snapshots (parent/child tree, creation time, state
+    and current snapshot) of all domains which have snapshots
+    snapshots created or deleted by other clients emit no event, so the index
+    expires after ttl seconds, readers should check fresh instead of synced
+    """
+
+    def __init__(self, refresher=None, ttl=60):
+        super(cvmSnapshotIndex, self).__init__(refresher, ttl)
+        # maps domain names to {'snapshots': {name: snapshot dict}, 'current': name or None}
+        self._domains = {}
+
+    def _register_events(self, connection):
+        callback_id = connection.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._callback(self.__lifecycle_callback), None)
+        self._register(connection.domainEventDeregisterAny, callback_id)
+
+    def _load(self, connection):
+        return dict((dom.name(), self._load_domain(dom)) for dom in
+                    connection.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_HAS_SNAPSHOT))
+
+    def _replace(self, data):
+        self._domains = data
+
+    def _load_entry(self, connection, key):
+        try:
+            dom = connection.lookupByName(key)
+        except libvirtError:
+            return None
+        entry = self._load_domain(dom)
+        return entry if entry['snapshots'] else None
+
+    def _set_entry(self, key, entry):
+        if entry is None:
+            self._domains.pop(key, None)
+        else:
+            self._domains[key] = entry
+
+    @staticmethod
+    def _load_domain(dom):
+        snapshots = {}
+        for snap in dom.listAllSnapshots(0):
+            # snapshot xml embeds the whole domain xml, parse it once and do not cache it
+            doc = util.XMLDocument(snap.getXMLDesc(0))
+            try:
+                creation_time = doc.get('/domainsnapshot/creationTime')
+                snapshots[snap.getName()] = {
+                    'name': snap.getName(),
+                    'parent': doc.get('/domainsnapshot/parent/name'),
+                    'creation_time': int(creation_time) if creation_time else None,
+                    'state': doc.get('/domainsnapshot/state'),
+                    'description': doc.get('/domainsnapshot/description'),
+                    'children': [],
+                }
+            finally:
+                doc.free()
+
+        for snapshot in snapshots.values():
+            if snapshot['parent'] in snapshots:
+                snapshots[snapshot['parent']]['children'].append(snapshot['name'])
+
+        current = dom.snapshotCurrent(0).getName() if dom.hasCurrentSnapshot(0) else None
+        return {'snapshots': snapshots, 'current': current}
+
+    def __lifecycle_callback(self, connection, dom, event, detail, opaque=None):
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            with self._lock:
+                self._domains.pop(dom.name(), None)
+        elif (event, detail) in _SNAPSHOT_EVENT_DETAILS:
+            self.invalidate(dom.name())
+
+    def domains(self):
+        """returns the names of all domains which have snapshots"""
+        with self._lock:
+            return sorted(self._domains)
+
+    def snapshots(self, domain):
+        """returns the snapshots of the domain sorted by creation time"""
+        with self._lock:
+            entry = self._domains.get(domain)
+            snapshots = [dict(snapshot, current=snapshot['name'] == entry['current'])
+                         for snapshot in entry['snapshots'].values()] if entry is not None else []
+        return sorted(snapshots, key=lambda snapshot: (snapshot['creation_time'], snapshot['name']))
+
+    def current(self, domain):
+        with self._lock:
+            entry = self._domains.get(domain)
+            return entry['current'] if entry is not None else None
+
+    def tree(self, domain):
+        """returns the snapshot tree of the domain as nested dicts, starting at the roots"""
+        snapshots = dict((snapshot['name'], snapshot) for snapshot in self.snapshots(domain))
+
+        def node(name):
+            snapshot = dict(snapshots[name])
+            snapshot['children'] = [node(child) for child in sorted(
+                snapshot['children'], key=lambda child: snapshots[child]['creation_time'])]
+            return snapshot
+
+        return [node(name) for name, snapshot in snapshots.items() if snapshot['parent'] not in snapshots]
+
+
+# capabilities of the node devices which are indexed
+NODE_DEVICE_CAPABILITIES = (
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_NET |
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_PCI_DEV |
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_USB_DEV |
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SCSI_HOST |
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SCSI |
+    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_STORAGE
+)
+
+# list flags of the capability types of the device xml, listAllDevices filters by them
+NODE_DEVICE_CAPABILITY_FLAGS = {
+    'system': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SYSTEM,
+    'pci': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_PCI_DEV,
+    'usb_device': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_USB_DEV,
+    'usb': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_USB_INTERFACE,
+    'net': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_NET,
+    'scsi_host': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SCSI_HOST,
+    'scsi_target': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SCSI_TARGET,
+    'scsi': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_SCSI,
+    'storage': libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_STORAGE,
+}
+
+
+def _pci_address(doc):
+    values = [doc.get("/device/capability[@type='pci']/{}".format(key))
+              for key in ('domain', 'bus', 'slot', 'function')]
+    if None in values:
+        return None
+    return '{:04x}:{:02x}:{:02x}.{:x}'.format(*(int(value, 0) for value in values))
+
+
+class cvmNodeDeviceIndex(cvmEventIndex):
+    """
+    per host index of node devices, every device xml is parsed once on load,
+    devices can be looked up by capability type, pci address and parent
+    """
+
+    def __init__(self, flags=NODE_DEVICE_CAPABILITIES, refresher=None):
+        super(cvmNodeDeviceIndex, self).__init__(refresher)
+        self.flags = flags
+        # maps device names to device dicts
+        self._devices = {}
+        self._by_capability = {}
+        self._by_pci_address = {}
+        self._by_parent = {}
+
+    def _register_events(self, connection):
+        callback_id = connection.nodeDeviceEventRegisterAny(
+            None, libvirt.VIR_NODE_DEVICE_EVENT_ID_LIFECYCLE, self._callback(self.__lifecycle_callback), None)
+        self._register(connection.nodeDeviceEventDeregisterAny, callback_id)
+
+    def _load(self, connection):
+        return dict((dev.name(), self._load_device(dev)) for dev in connection.listAllDevices(self.flags))
+
+    def _replace(self, data):
+        self._devices = {}
+        self._by_capability = {}
+        self._by_pci_address = {}
+        self._by_parent = {}
+        for name, device in data.items():
+            self._add(name, device)
+
+    def _load_entry(self, connection, key):
+        try:
+            device = self._load_device(connection.nodeDeviceLookupByName(key))
+        except libvirtError:
+            return None
+        # events come for all devices, only the ones listAllDevices(flags) returns are indexed
+        if not any(NODE_DEVICE_CAPABILITY_FLAGS.get(capability, 0) & self.flags
+                   for capability in device['capabilities']):
+            return None
+        return device
+
+    def _set_entry(self, key, entry):
+        self._remove(key)
+        if entry is not None:
+            self._add(key, entry)
+
+    def _add(self, name, device):
+        self._devices[name] = device
+        for capability in device['capabilities']:
+            self._by_capability.setdefault(capability, set()).add(name)
+        if device['pci_address']:
+            self._by_pci_address[device['pci_address']] = name
+        self._by_parent.setdefault(device['parent'], set()).add(name)
+
+    def _remove(self, name):
+        device = self._devices.pop(name, None)
+        if device is None:
+            return
+        for capability in device['capabilities']:
+            self._by_capability.get(capability, set()).discard(name)
+        if self._by_pci_address.get(device['pci_address']) == name:
+            del self._by_pci_address[device['pci_address']]
+        self._by_parent.get(device['parent'], set()).discard(name)
+
+    @staticmethod
+    def _load_device(dev):
+        doc = util.XMLDocument(dev.XMLDesc(0))
+        try:
+            return {
+                'name': doc.get('/device/name'),
+                'parent': doc.get('/device/parent'),
+                'driver': doc.get('/device/driver/name'),
+                'capabilities': doc.get_all('/device/capability/@type'),
+                'pci_address': _pci_address(doc),
+                'vendor': doc.get('/device/capability/vendor'),
+                'product': doc.get('/device/capability/product'),
+                # net devices only
+                'interface': doc.get("/device/capability[@type='net']/interface"),
+                'mac_address': doc.get("/device/capability[@type='net']/address"),
+            }
+        finally:
+            doc.free()
+
+    def __lifecycle_callback(self, connection, dev, event, detail, opaque=None):
+        if event == libvirt.VIR_NODE_DEVICE_EVENT_DELETED:
+            with self._lock:
+                self._remove(dev.name())
+        else:
+            self.invalidate(dev.name())
+
+    def get(self, name):
+        with self._lock:
+            return self._devices.get(name)
+
+    def by_capability(self, capability):
+        """returns the devices with the given capability type (net, pci, usb_device, ...) sorted by name"""
+        with self._lock:
+            return [self._devices[name] for name in sorted(self._by_capability.get(capability, ()))]
+
+    def by_pci_address(self, address):
+        """returns the pci device with the given address (e.g. 0000:00:19.0) or None"""
+        with self._lock:
+            name = self._by_pci_address.get(address)
+            return self._devices[name] if name is not None else None
+
+    def children(self, parent):
+        """returns the indexed child devices of the given parent device sorted by name"""
+        with self._lock:
+            return [self._devices[name] for name in sorted(self._by_parent.get(parent, ()))]
+
+
+class cvmStorageIndex(cvmEventIndex):
+    """
+    per host index of storage pools with their capacity and volumes,
+    pools are reloaded on storage pool lifecycle and refresh events
+    """
+
+    def __init__(self, refresher=None):
+        super(cvmStorageIndex, self).__init__(refresher)
+        # maps pool names to pool dicts
+        self._pools = {}
+        # time of the last pool.refresh() per pool name, see refresh_pools
+        self._refreshed_at = {}
+
+    def _register_events(self, connection):
+        for event_id in (libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE, libvirt.VIR_STORAGE_POOL_EVENT_ID_REFRESH):
+            callback_id = connection.storagePoolEventRegisterAny(
+                None, event_id, self._callback(self.__pool_callback), None)
+            self._register(connection.storagePoolEventDeregisterAny, callback_id)
+
+    def _load(self, connection):
+        return self.load_pools(connection)
+
+    def _replace(self, data):
+        self._pools = data
+
+    def _load_entry(self, connection, key):
+        try:
+            return self._load_pool(connection.storagePoolLookupByName(key))
+        except libvirtError:
+            return None
+
+    def _set_entry(self, key, entry):
+        if entry is None:
+            self._pools.pop(key, None)
+        else:
+            self._pools[key] = entry
+
+    @classmethod
+    def load_pools(cls, connection):
+        """returns the pool dicts of all pools of the connection keyed by name"""
+        return dict((pool.name(), cls._load_pool(pool)) for pool in connection.listAllStoragePools(0))
+
+    @staticmethod
+    def _load_pool(pool):
+        state, capacity, allocation, available = pool.info()
+        active = state == libvirt.VIR_STORAGE_POOL_RUNNING
+        volumes = []
+        if active:
+            # volumes of inactive pools can not be listed
+            for vol in pool.listAllVolumes(0):
+                vol_type, vol_capacity, vol_allocation = vol.info()
+                volumes.append({'name': vol.name(), 'key': vol.key(), 'type': vol_type,
+                                'capacity': vol_capacity, 'allocation': vol_allocation})
+        return {
+            'name': pool.name(),
+            'uuid': pool.UUIDString(),
+            'active': active,
+            'state': state,
+            # bytes
+            'capacity': capacity,
+            'allocation': allocation,
+            'available': available,
+            'volumes': sorted(volumes, key=lambda vol: vol['name']),
+        }
+
+    def __pool_callback(self, connection, pool, *args):
+        # lifecycle callbacks get (event, detail, opaque), refresh callbacks only opaque
+        if len(args) == 3 and args[0] == libvirt.VIR_STORAGE_POOL_EVENT_UNDEFINED:
+            with self._lock:
+                self._pools.pop(pool.name(), None)
+        else:
+            self.invalidate(pool.name())
+
+    def refresh_pools(self, min_interval):
+        """
+        asks libvirtd to rescan every active pool not refreshed for min_interval seconds,
+        the refresh events reload the pools, returns the number of refreshed pools
+        """
+        connection = self._connection
+        if connection is None:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            names = [name for name, pool in self._pools.items()
+                     if pool['active'] and now - self._refreshed_at.get(name, 0) >= min_interval]
+
+        refreshed = 0
+        for name in names:
+            try:
+                connection.storagePoolLookupByName(name).refresh(0)
+            except libvirtError:
+                continue
+            self._refreshed_at[name] = now
+            # older libvirtd do not emit refresh events
+            self.invalidate(name)
+            refreshed += 1
+        return refreshed
+
+    def pools(self):
+        with self._lock:
+            return [self._pools[name] for name in sorted(self._pools)]
+
+    def get(self, name):
+        with self._lock:
+            return self._pools.get(name)
+
+    def capacity(self):
+        """returns the summed capacity, allocation and available bytes of the active pools"""
+        totals = {'pools': 0, 'capacity': 0, 'allocation': 0, 'available': 0}
+        with self._lock:
+            for pool in self._pools.values():
+                if pool['active']:
+                    totals['pools'] += 1
+                    for key in ('capacity', 'allocation', 'available'):
+                        totals[key] += pool[key]
+        return totals
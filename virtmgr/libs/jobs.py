@@ -0,0 +1,309 @@
+import collections
+import datetime
+import json
+import queue
+import threading
+import time
+
+import libvirt
+
+from virtmgr.libs.connection import connection_manager, cvmConnect
+from virtmgr.libs.pool import LANE_LONG
+from virtmgr import app, db
+from virtmgr.models import Job, JOB_CANCELLED, JOB_FAILED, JOB_FINISHED, JOB_PENDING, JOB_RUNNING, JOB_SUCCEEDED
+
+
+class cvmJobCancelled(Exception):
+    pass
+
+
+class cvmJobsUnavailable(Exception):
+    """no job workers run in this process, submitted jobs would never be picked up"""
+    pass
+
+
+class cvmJobContext(object):
+    """
+    handed to job handlers to report progress and to check for cancellation
+    """
+
+    def __init__(self, manager, job_id, timeout):
+        self.manager = manager
+        self.job_id = job_id
+        self.deadline = time.time() + timeout if timeout else None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set() or (self.deadline is not None and time.time() > self.deadline)
+
+    def check_cancelled(self):
+        """raises cvmJobCancelled if the job was cancelled or ran out of time"""
+        if self.cancel_event.is_set():
+            raise cvmJobCancelled('cancelled')
+        if self.deadline is not None and time.time() > self.deadline:
+            raise cvmJobCancelled('timed out')
+
+    def set_progress(self, progress, message=None):
+        job = self.manager.update(self.job_id, progress=int(progress), message=message)
+        # picks up cancellations requested through another process
+        if job.cancel_requested:
+            self.cancel_event.set()
+
+
+class cvmJobManager(object):
+    """
+    runs registered job handlers in a pool of worker threads, at most host_concurrency
+    jobs per server at a time, job state is kept in the database
+    """
+
+    def __init__(self, workers=8, host_concurrency=2, timeout=3600):
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.timeout = timeout
+
+        # maps job types to handler(context, server_host, **params)
+        self.handlers = {}
+
+        self._queue = queue.Queue()
+        # per server number of dispatched jobs and jobs waiting for a free slot
+        self._dispatched = collections.defaultdict(int)
+        self._waiting = collections.defaultdict(collections.deque)
+        # contexts of running jobs, used for cancellation
+        self._running = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def register(self, job_type):
+        """decorator registering a handler for the given job type"""
+        def decorator(func):
+            self.handlers[job_type] = func
+            return func
+        return decorator
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.running:
+            return
+        with app.app_context():
+            self.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='job worker {}'.format(i))
+            # run in deamon mode, so it does not block shutdown of the server
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def recover(self):
+        """
+        running jobs without an update for longer than the job timeout failed, pending ones
+        are queued again, other processes may dispatch them as well, only one claims each job
+        """
+        # jobs of other (still running) processes update their progress and are left alone
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.timeout or 0)
+        Job.query.filter(Job.status == JOB_RUNNING, Job.updated_at < stale).update(
+            {'status': JOB_FAILED, 'message': 'interrupted by restart'}, synchronize_session=False)
+        db.session.commit()
+
+        for job in Job.query.filter_by(status=JOB_PENDING).order_by(Job.id):
+            self._dispatch(job.id, job.server_id)
+
+    def submit(self, job_type, server_host, params=None):
+        """
+        stores a new pending job and queues it, returns the Job
+        raises ValueError for unknown job types, cvmJobsUnavailable if the workers were not started
+        """
+        if job_type not in self.handlers:
+            raise ValueError('"{}" is not a valid job type'.format(job_type))
+        if not self.running:
+            raise cvmJobsUnavailable('job workers are not running')
+
+        job = Job(type=job_type, server_id=server_host.id, status=JOB_PENDING, progress=0,
+                  params=json.dumps(params or {}))
+        db.session.add(job)
+        db.session.commit()
+        self._dispatch(job.id, job.server_id)
+        return job
+
+    def cancel(self, job):
+        """
+        cancels a pending job right away, a running one is asked to stop
+        returns False if the job is already finished
+        """
+        if job.finished:
+            return False
+
+        # conditional updates, a worker may claim the job at the same time
+        cancelled = Job.query.filter_by(id=job.id, status=JOB_PENDING).update(
+            {'status': JOB_CANCELLED, 'message': 'cancelled', 'cancel_requested': True}, synchronize_session=False)
+        if not cancelled:
+            # the worker checks the flag once it registered the job
+            Job.query.filter(Job.id == job.id, Job.status.notin_(JOB_FINISHED)).update(
+                {'cancel_requested': True}, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(job)
+
+        with self._lock:
+            context = self._running.get(job.id)
+        if context is not None:
+            context.cancel_event.set()
+        return True
+
+    def update(self, job_id, **values):
+        # called from the worker thread, inside the app context of the running job
+        job = Job.query.get(job_id)
+        for key, value in values.items():
+            if value is not None:
+                setattr(job, key, value)
+        db.session.commit()
+        return job
+
+    def _dispatch(self, job_id, server_id):
+        with self._lock:
+            if self._dispatched[server_id] < self.host_concurrency:
+                self._dispatched[server_id] += 1
+                self._queue.put((job_id, server_id))
+            else:
+                self._waiting[server_id].append(job_id)
+
+    def _done(self, server_id):
+        # hand the slot of the server to its next waiting job
+        with self._lock:
+            if self._waiting[server_id]:
+                self._queue.put((self._waiting[server_id].popleft(), server_id))
+            else:
+                self._dispatched[server_id] -= 1
+
+    def _work(self):
+        while True:
+            job_id, server_id = self._queue.get()
+            try:
+                with app.app_context():
+                    self._run(job_id)
+            except Exception as err:
+                app.logger.exception('job %s crashed: %s', job_id, err)
+            finally:
+                self._done(server_id)
+
+    def _run(self, job_id):
+        # claim the job, it may have been cancelled while waiting or claimed by another process
+        claimed = Job.query.filter_by(id=job_id, status=JOB_PENDING).update(
+            {'status': JOB_RUNNING}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return
+
+        context = cvmJobContext(self, job_id, self.timeout)
+        with self._lock:
+            self._running[job_id] = context
+        try:
+            # a cancel between the claim and the registration only set the flag
+            job = Job.query.get(job_id)
+            if job.cancel_requested:
+                context.cancel_event.set()
+            server_host, params = job.server, job.get_params()
+
+            try:
+                context.check_cancelled()
+                result = self.handlers[job.type](context, server_host, **params)
+                status, message, progress = JOB_SUCCEEDED, None, 100
+            except cvmJobCancelled as err:
+                result, status, message, progress = None, JOB_CANCELLED, str(err), None
+            except Exception as err:
+                result, status, message, progress = None, JOB_FAILED, str(err), None
+
+            job = Job.query.get(job_id)
+            job.status = status
+            job.message = message
+            if progress is not None:
+                job.progress = progress
+            job.result = json.dumps(result) if result is not None else None
+            db.session.commit()
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+
+job_manager = cvmJobManager(
+    app.config.get('JOB_WORKERS', 8),
+    app.config.get('JOB_HOST_CONCURRENCY', 2),
+    app.config.get('JOB_TIMEOUT', 3600)
+)
+
+
+@job_manager.register('domain.create')
+def create_domain(context, server_host, xml, start=True):
+    with cvmConnect(server_host.hostname, server_host.type, lane=LANE_LONG) as conn:
+        dom = conn.cvm.defineXML(xml)
+        context.set_progress(50, 'defined')
+        context.check_cancelled()
+        if start:
+            dom.create()
+        return {'name': dom.name(), 'uuid': dom.UUIDString()}
+
+
+@job_manager.register('domain.snapshot')
+def create_snapshot(context, server_host, domain, xml, flags=0):
+    with cvmConnect(server_host.hostname, server_host.type, lane=LANE_LONG) as conn:
+        dom = conn.get_instance(domain)
+        context.check_cancelled()
+        context.set_progress(10, 'creating snapshot')
+        # a single libvirt call, it can not be interrupted once started
+        snapshot = dom.snapshotCreateXML(xml, flags)
+        # creating a snapshot does not emit an event the index could pick up
+        connection_manager.get_snapshot_index(server_host.hostname, server_host.type).invalidate(domain)
+        return {'domain': domain, 'snapshot': snapshot.getName()}
+
+
+@job_manager.register('domain.migrate')
+def migrate_domain(context, server_host, domain, dest_uri, flags=libvirt.VIR_MIGRATE_LIVE):
+    with cvmConnect(server_host.hostname, server_host.type, lane=LANE_LONG) as conn:
+        dom = conn.get_instance(domain)
+        done = threading.Event()
+        errors = []
+
+        def migrate():
+            try:
+                dom.migrateToURI3(dest_uri, {}, flags)
+            except libvirt.libvirtError as err:
+                errors.append(err)
+            finally:
+                done.set()
+
+        threading.Thread(target=migrate, name='migrate {}'.format(domain), daemon=True).start()
+        # report progress from the migration job, abort it on cancellation
+        while not done.wait(2):
+            if context.cancelled:
+                dom.abortJob()
+                done.wait()
+                context.check_cancelled()
+            try:
+                stats = dom.jobStats()
+            except libvirt.libvirtError:
+                continue
+            if stats.get('data_total'):
+                context.set_progress(stats.get('data_processed', 0) * 100 // stats['data_total'])
+
+        if errors:
+            raise errors[0]
+        return {'domain': domain, 'dest_uri': dest_uri}
+
+
+@job_manager.register('volume.upload')
+def upload_volume(context, server_host, path, src_path, sparse=True):
+    last = [-1]
+
+    def progress(sent, size):
+        # raises cvmJobCancelled, which aborts the stream
+        context.check_cancelled()
+        percent = sent * 100 // size if size else 100
+        # only every full percent hits the database
+        if percent != last[0]:
+            last[0] = percent
+            context.set_progress(percent, '{} of {} bytes'.format(sent, size))
+
+    with cvmConnect(server_host.hostname, server_host.type, lane=LANE_LONG) as conn:
+        return conn.upload_volume(path, src_path, sparse, progress)
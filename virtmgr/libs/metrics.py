@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+
+from virtmgr.libs.profiling import TIME_LIBVIRT, request_timer
+
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class cvmCallMetrics(object):
+    """
+    latency histograms and error counters of libvirt calls per (host, method)
+    every thread records into its own dict without locking, the dicts are only
+    merged when metrics are collected, dicts of finished threads are folded into
+    a retired dict so short lived worker threads do not pile up
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        # (thread, stats dict) of all threads which recorded something
+        self._threads = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _stats(self):
+        try:
+            return self._local.stats
+        except AttributeError:
+            stats = self._local.stats = {}
+            with self._lock:
+                # fold finished threads here as well, collect() may never be called
+                self._retire()
+                self._threads.append((threading.current_thread(), stats))
+            return stats
+
+    def _retire(self):
+        # needs the lock, merges the dicts of finished threads into the retired dict
+        alive = []
+        for thread, stats in self._threads:
+            if thread.is_alive():
+                alive.append((thread, stats))
+            else:
+                self._merge(self._retired, stats)
+        self._threads = alive
+
+    def observe(self, host, method, elapsed, error=False):
+        stats = self._stats()
+        entry = stats.get((host, method))
+        if entry is None:
+            # bucket counts (the last one is +Inf), sum of seconds, errors
+            entry = stats[(host, method)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, elapsed)] += 1
+        entry[1] += elapsed
+        if error:
+            entry[2] += 1
+
+    @staticmethod
+    def _merge(target, stats):
+        # list() copies the items while holding the GIL, the owning thread may keep adding keys
+        for key, (counts, total, errors) in list(stats.items()):
+            entry = target.get(key)
+            if entry is None:
+                target[key] = [list(counts), total, errors]
+            else:
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += errors
+
+    def collect(self):
+        """returns {(host, method): [bucket counts, sum, errors]} merged over all threads"""
+        with self._lock:
+            self._retire()
+
+            merged = {}
+            self._merge(merged, self._retired)
+            for _, stats in self._threads:
+                self._merge(merged, stats)
+        return merged
+
+
+call_metrics = cvmCallMetrics()
+# connect and rpc latency per transport (tcp, tls, ssh, socket), keyed by (transport, operation)
+transport_metrics = cvmCallMetrics()
+
+
+class cvmInstrumentedConnection(object):
+    """
+    proxy of a libvirt connection which records the latency and errors of all
+    method calls, everything else is passed through to the wrapped connection
+    """
+
+    def __init__(self, connection, host, transport=None, metrics=call_metrics):
+        self._connection = connection
+        self._host = host
+        self._transport = transport
+        self._metrics = metrics
+
+    @property
+    def wrapped(self):
+        return self._connection
+
+    def __getattr__(self, name):
+        attr = getattr(self._connection, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        host, transport, metrics = self._host, self._transport, self._metrics
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = attr(*args, **kwargs)
+                error = False
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.observe(host, name, elapsed, error)
+                if transport is not None:
+                    transport_metrics.observe(transport, 'rpc', elapsed, error)
+                request_timer.add(TIME_LIBVIRT, elapsed)
+            return result
+
+        # cached on the proxy, later lookups do not go through __getattr__ again
+        setattr(self, name, timed)
+        return timed
+
+    def __repr__(self):
+        return '<cvmInstrumentedConnection {!r}>'.format(self._connection)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in sorted(labels.items())) + '}'
+
+
+def _render_histograms(metrics, name, description, label_names):
+    collected = sorted(metrics.collect().items())
+    lines = [
+        '# HELP {}_duration_seconds {}'.format(name, description),
+        '# TYPE {}_duration_seconds histogram'.format(name),
+    ]
+    for key, (counts, total, errors) in collected:
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(metrics.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('{}_duration_seconds_bucket{} {}'.format(name, _labels(le=bound, **labels), cumulative))
+        lines.append('{}_duration_seconds_sum{} {}'.format(name, _labels(**labels), total))
+        lines.append('{}_duration_seconds_count{} {}'.format(name, _labels(**labels), cumulative))
+
+    lines.append('# HELP {}_errors_total Failures of the above.'.format(name))
+    lines.append('# TYPE {}_errors_total counter'.format(name))
+    for key, (counts, total, errors) in collected:
+        lines.append('{}_errors_total{} {}'.format(name, _labels(**dict(zip(label_names, key))), errors))
+    return lines
+
+
+def render_call_metrics(metrics=call_metrics):
+    """renders the libvirt call metrics in the prometheus text format"""
+    return _render_histograms(metrics, 'virtmgr_libvirt_call', 'Latency of libvirt calls.', ('host', 'method'))
+
+
+def render_transport_metrics(metrics=transport_metrics):
+    """renders the connect and rpc latency per transport in the prometheus text format"""
+    return _render_histograms(metrics, 'virtmgr_libvirt_transport', 'Connect and rpc latency per transport.',
+                              ('transport', 'operation'))
+
+
+def render_connection_metrics(connections):
+    """renders the state of the given cvmConnections in the prometheus text format"""
+    connections = sorted(connections, key=lambda connection: connection.host)
+    lines = [
+        '# HELP virtmgr_libvirt_connected Whether the shared connection to the host is alive.',
+        '# TYPE virtmgr_libvirt_connected gauge',
+    ]
+    for connection in connections:
+        lines.append('virtmgr_libvirt_connected{} {}'.format(
+            _labels(host=connection.host, transport=connection.transport_name), int(connection.connected)))
+
+    lines.append('# HELP virtmgr_libvirt_reconnects_total Reconnects of the shared connection to the host.')
+    lines.append('# TYPE virtmgr_libvirt_reconnects_total counter')
+    for connection in connections:
+        lines.append('virtmgr_libvirt_reconnects_total{} {}'.format(
+            _labels(host=connection.host), connection.reconnect_count))
+
+    lines.append('# HELP virtmgr_libvirt_last_error_info Last error of the connection to the host.')
+    lines.append('# TYPE virtmgr_libvirt_last_error_info gauge')
+    for connection in connections:
+        last_error = connection.last_error
+        if last_error:
+            lines.append('virtmgr_libvirt_last_error_info{} 1'.format(_labels(host=connection.host, error=last_error)))
+    return lines
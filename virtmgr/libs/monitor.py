@@ -0,0 +1,104 @@
+import concurrent.futures
+import threading
+import time
+
+from virtmgr.libs import util
+from virtmgr.libs.connection import connection_manager
+from virtmgr import app
+
+
+class cvmHostMonitor(threading.Thread):
+    """
+    background thread probing every registered host periodically
+    the request path only ever reads the cached status, so api latency
+    does not depend on network timeouts to hosts that are down
+    """
+
+    def __init__(self, interval=10, max_workers=32, timeout=5, deadline=6):
+        super(cvmHostMonitor, self).__init__(name='host monitor')
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+
+        self.interval = interval
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.deadline = deadline
+
+        # callable returning a list of (hostname, connection type) tuples to probe
+        self.hosts_func = None
+
+        # maps hostnames to their status dict, replaced as a whole after every round
+        self._status = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.probe_all()
+            except Exception as err:
+                # keep the last known status if the host list is not available
+                app.logger.warning('host monitor round failed: %s', err)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _probe(self, target):
+        hostname, conn = target
+        start = time.time()
+        result = connection_manager.host_is_up(hostname, self.timeout, conn)
+        latency = time.time() - start
+        return result, latency
+
+    def probe_all(self):
+        targets = self.hosts_func() if self.hosts_func is not None else []
+        # every probe gets its own timeout counted from its start, hosts queued behind
+        # unreachable ones still get their full time until the deadline of the round
+        results = util.map_concurrently(
+            self._probe, set(targets), self.max_workers, self.deadline, item_timeout=self.timeout)
+
+        now = time.time()
+        previous = self._status
+        status = {}
+        for (hostname, conn), (result, error) in results.items():
+            if isinstance(error, concurrent.futures.CancelledError):
+                # not probed in this round, keep what the last round found
+                if hostname in previous:
+                    status[hostname] = previous[hostname]
+                continue
+            if error is None:
+                up, latency = result
+                alive = up is True
+                last_error = None if alive else str(up)
+            else:
+                # the probe did not finish in time
+                alive, latency, last_error = False, None, str(error)
+
+            status[hostname] = {
+                'alive': alive,
+                'checked_at': now,
+                'last_seen': now if alive else previous.get(hostname, {}).get('last_seen'),
+                'latency': latency,
+                # keepalive state of the libvirt connection, None if never connected
+                'libvirt_connected': connection_manager.is_connected(hostname, conn),
+                'last_error': last_error,
+            }
+        self._status = status
+
+    def status(self, hostname):
+        """returns the cached status dict of the given host (None if never probed)"""
+        entry = self._status.get(hostname)
+        return dict(entry) if entry is not None else None
+
+    def is_alive(self, hostname):
+        """returns whether the given host answered its last probe, None if it was never probed"""
+        entry = self._status.get(hostname)
+        return entry['alive'] if entry is not None else None
+
+
+host_monitor = cvmHostMonitor(
+    app.config.get('HOST_MONITOR_INTERVAL', 10),
+    app.config.get('SERVER_PROBE_CONCURRENCY', 32),
+    app.config.get('SERVER_PROBE_TIMEOUT', 5),
+    app.config.get('SERVER_PROBE_DEADLINE', 6)
+)
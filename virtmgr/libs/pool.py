@@ -0,0 +1,158 @@
+import collections
+import contextlib
+import threading
+import time
+
+from libvirt import libvirtError
+
+
+# lanes of pooled connections, long running operations (migrations, volume uploads, ...)
+# get their own connections so that short reads are never queued behind them
+LANE_SHORT = 'short'
+LANE_LONG = 'long'
+
+
+class cvmConnectionPool(object):
+    """
+    bounded pool of libvirt connections to a single host with checkout/return semantics
+    fill() opens connections up to min_size ahead of use, connections idle for longer
+    than idle_timeout are closed, down to min_size (see cvmPoolMaintainer)
+    """
+
+    def __init__(self, factory, min_size=0, max_size=4, idle_timeout=300, checkout_timeout=30):
+        # factory returns a new cvmConnection, it is called without holding the pool lock
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+
+        # idle connections as (cvmConnection, returned at), the most recently returned one last
+        self._idle = collections.deque()
+        # number of connections owned by the pool, idle and checked out
+        self._size = 0
+        self._condition = threading.Condition(threading.Lock())
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def checkout(self, timeout=None):
+        """
+        returns a connected cvmConnection, waiting at most timeout seconds for one to be returned
+        raises libvirtError if the pool is exhausted or connecting fails
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        endtime = time.time() + timeout
+
+        dead = []
+        self._condition.acquire()
+        try:
+            while True:
+                while self._idle:
+                    connection, _ = self._idle.pop()
+                    if connection.connected:
+                        return connection
+                    self._size -= 1
+                    dead.append(connection)
+
+                if self._size < self.max_size:
+                    # reserve the slot, the connection itself is opened without the lock
+                    self._size += 1
+                    break
+
+                remaining = endtime - time.time()
+                if remaining <= 0:
+                    raise libvirtError('no free connection in pool after {}s'.format(timeout))
+                self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+            for connection in dead:
+                connection.close()
+
+        try:
+            connection = self.factory()
+            if not connection.connected:
+                raise libvirtError(connection.last_error)
+        except Exception:
+            self._release_slot()
+            raise
+        return connection
+
+    def checkin(self, connection):
+        """returns a connection to the pool, broken connections are dropped"""
+        if not connection.connected:
+            self._release_slot()
+            connection.close()
+            return
+
+        with self._condition:
+            self._idle.append((connection, time.time()))
+            expired = self._expire_idle()
+            self._condition.notify()
+
+        for connection in expired:
+            connection.close()
+
+    def fill(self):
+        """
+        opens idle connections until the pool holds min_size, returns the number opened
+        raises libvirtError if connecting fails
+        """
+        opened = 0
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return opened
+                # reserve the slot, the connection itself is opened without the lock
+                self._size += 1
+
+            try:
+                connection = self.factory()
+                if not connection.connected:
+                    raise libvirtError(connection.last_error)
+            except Exception:
+                self._release_slot()
+                raise
+
+            with self._condition:
+                self._idle.append((connection, time.time()))
+                self._condition.notify()
+            opened += 1
+
+    def evict_idle(self):
+        """closes connections idle for longer than idle_timeout"""
+        with self._condition:
+            expired = self._expire_idle()
+        for connection in expired:
+            connection.close()
+        return len(expired)
+
+    def _expire_idle(self):
+        # needs the pool lock, the oldest idle connections are first in line
+        expired = []
+        now = time.time()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.popleft()
+            self._size -= 1
+            expired.append(connection)
+        return expired
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """context manager yielding a pooled libvirt connection object (instrumented, see cvmConnection)"""
+        connection = self.checkout(timeout)
+        try:
+            yield connection.instrumented
+        finally:
+            self.checkin(connection)
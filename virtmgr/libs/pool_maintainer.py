@@ -0,0 +1,50 @@
+import threading
+
+from libvirt import libvirtError
+
+from virtmgr.libs.connection import connection_manager
+from virtmgr import app
+
+
+class cvmPoolMaintainer(threading.Thread):
+    """
+    background thread closing pooled connections idle for longer than their pool's
+    idle timeout and opening connections up to the pool's min_size, pools are only
+    created on first use, so min_size applies to hosts which were leased from before
+    """
+
+    def __init__(self, interval=30):
+        super(cvmPoolMaintainer, self).__init__(name='pool maintainer')
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.maintain_all()
+            except Exception as err:
+                app.logger.warning('pool maintenance round failed: %s', err)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def maintain_all(self):
+        """returns the number of closed and opened connections"""
+        closed = opened = 0
+        for pool in connection_manager.pools():
+            closed += pool.evict_idle()
+            try:
+                opened += pool.fill()
+            except libvirtError as err:
+                # the host is down, the next round tries again
+                app.logger.warning('filling connection pool failed: %s', err)
+        return closed, opened
+
+
+pool_maintainer = cvmPoolMaintainer(
+    app.config.get('LIBVIRT_POOL_MAINTENANCE_INTERVAL', 30) or 30
+)
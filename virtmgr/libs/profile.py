@@ -0,0 +1,90 @@
+import threading
+
+from virtmgr.libs import util
+
+
+def _numa_cells(ctx):
+    cells = []
+    for cell in ctx.xpathEval('/capabilities/host/topology/cells/cell'):
+        ctx.setContextNode(cell)
+        memory = ctx.xpathEval('memory')
+        cells.append({
+            'id': int(cell.prop('id')),
+            # KiB
+            'memory': int(memory[0].content) if memory else None,
+            'cpus': [int(cpu.prop('id')) for cpu in ctx.xpathEval('cpus/cpu')],
+        })
+    return cells
+
+
+def _machine_types(ctx):
+    machines = {}
+    for arch in ctx.xpathEval('/capabilities/guest/arch'):
+        ctx.setContextNode(arch)
+        types = machines.setdefault(arch.prop('name'), set())
+        types.update(machine.content for machine in ctx.xpathEval('machine|domain/machine'))
+    return dict((arch, sorted(types)) for arch, types in machines.items())
+
+
+class cvmHostProfile(object):
+    """
+    pre parsed host data of a libvirt connection, it only changes when libvirtd
+    restarts, so it is loaded once per (re)connect
+    """
+
+    def __init__(self, connection):
+        self.cap_xml = connection.getCapabilities()
+        # parsed once, not kept in the shared document cache
+        doc = util.XMLDocument(self.cap_xml)
+        try:
+            self.arch = doc.get('/capabilities/host/cpu/arch')
+            self.cpu_model = doc.get('/capabilities/host/cpu/model')
+            self.cpu_vendor = doc.get('/capabilities/host/cpu/vendor')
+            self.cpu_topology = dict(
+                (key, int(doc.get('/capabilities/host/cpu/topology/@{}'.format(key)) or 0))
+                for key in ('sockets', 'cores', 'threads'))
+            self.kvm = bool(doc.get("//domain/@type='kvm'"))
+            self.numa_cells = doc.call(_numa_cells)
+            self.machine_types = doc.call(_machine_types)
+        finally:
+            doc.free()
+        self.max_vcpus = util.get_max_vcpus(connection, 'kvm' if self.kvm else None)
+
+    def to_dict(self):
+        return {
+            'arch': self.arch,
+            'cpu_model': self.cpu_model,
+            'cpu_vendor': self.cpu_vendor,
+            'cpu_topology': self.cpu_topology,
+            'kvm': self.kvm,
+            'max_vcpus': self.max_vcpus,
+            'numa_cells': self.numa_cells,
+            'machine_types': self.machine_types,
+        }
+
+
+class cvmHostProfileCache(object):
+    """
+    lazily loaded profile of a single connection, reset when the connection goes away
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profile = None
+
+    def get(self, connection):
+        """
+        returns the profile, loading it from the connection on first use
+        raises libvirtError if loading fails
+        """
+        profile = self._profile
+        if profile is None:
+            with self._lock:
+                profile = self._profile
+                if profile is None:
+                    profile = self._profile = cvmHostProfile(connection)
+        return profile
+
+    def invalidate(self):
+        with self._lock:
+            self._profile = None
@@ -0,0 +1,214 @@
+import collections
+import contextlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+
+# categories the wall time of a request is split into, the rest is reported as 'other'
+TIME_DB = 'db'
+TIME_LIBVIRT = 'libvirt'
+TIME_XML = 'xml'
+TIME_SERIALIZATION = 'serialization'
+TIME_CATEGORIES = (TIME_DB, TIME_LIBVIRT, TIME_XML, TIME_SERIALIZATION)
+
+slow_request_log = logging.getLogger('virtmgr.slow_requests')
+
+
+class cvmRequestTimer(object):
+    """
+    per thread accumulator of the time spent in db, libvirt, xml and serialization
+    code, only time spent on the request thread itself is accounted
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.times = dict.fromkeys(TIME_CATEGORIES, 0.0)
+        self._local.counts = dict.fromkeys(TIME_CATEGORIES, 0)
+        # nested measurements (e.g. xml parsing inside serialization) are only counted once
+        self._local.depth = 0
+
+    def stop(self):
+        times = getattr(self._local, 'times', None)
+        counts = getattr(self._local, 'counts', None)
+        self._local.times = None
+        self._local.counts = None
+        return times, counts
+
+    def add(self, category, seconds):
+        times = getattr(self._local, 'times', None)
+        if times is not None and not self._local.depth:
+            times[category] += seconds
+            self._local.counts[category] += 1
+
+    @contextlib.contextmanager
+    def measure(self, category):
+        if getattr(self._local, 'times', None) is None:
+            yield
+            return
+        start = time.perf_counter()
+        self._local.depth += 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            self.add(category, time.perf_counter() - start)
+
+
+request_timer = cvmRequestTimer()
+
+
+class cvmSamplingProfiler(threading.Thread):
+    """
+    samples the stacks of the threads of profiled requests at a fixed interval
+    and aggregates them as collapsed stacks (flame graph input)
+    """
+
+    def __init__(self, interval=0.005, max_stacks=10000):
+        super(cvmSamplingProfiler, self).__init__(name='request profiler')
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._stacks = collections.Counter()
+        # idents of the threads currently serving a profiled request
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def begin(self, ident):
+        if not self.is_alive():
+            with self._start_lock:
+                if not self.is_alive():
+                    self.start()
+        with self._lock:
+            self._threads.add(ident)
+        self._wakeup.set()
+
+    def end(self, ident):
+        with self._lock:
+            self._threads.discard(ident)
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        while True:
+            with self._lock:
+                threads = list(self._threads)
+            if not threads:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            frames = sys._current_frames()
+            stacks = [self._collapse(frames[ident]) for ident in threads if ident in frames]
+            with self._lock:
+                for stack in stacks:
+                    # keep known stacks counting once the table is full
+                    if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[stack] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """returns the samples as collapsed stacks, one 'frame;frame;frame count' line per stack"""
+        with self._lock:
+            return ''.join('{} {}\n'.format(stack, count) for stack, count in self._stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+
+
+request_profiler = cvmSamplingProfiler()
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_timer.add(TIME_DB, time.perf_counter() - conn.info['query_start'].pop())
+
+
+def init_app(app, api, profiler=None):
+    """
+    registers the request hooks on the app: time split per category, a Server-Timing
+    header, the slow request log and the sampling profiler for a share of the requests
+    json responses of the api are accounted as serialization time
+    """
+    # imported here, the module is also used by libs which do not need flask
+    import flask
+    from flask_restful.representations.json import output_json
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    event.listen(Engine, 'before_cursor_execute', _on_before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _on_after_cursor_execute)
+
+    @api.representation('application/json')
+    def timed_output_json(data, code, headers=None):
+        with request_timer.measure(TIME_SERIALIZATION):
+            return output_json(data, code, headers)
+
+    profiler = profiler or request_profiler
+    profiler.interval = app.config.get('PROFILER_INTERVAL', 0.005)
+    threshold = app.config.get('SLOW_REQUEST_THRESHOLD', 1.0)
+    sample_percent = app.config.get('PROFILER_SAMPLE_PERCENT', 0)
+
+    @app.before_request
+    def start_request_timer():
+        flask.g.request_start = time.perf_counter()
+        request_timer.start()
+        flask.g.profiled = sample_percent > 0 and random.uniform(0, 100) < sample_percent
+        if flask.g.profiled:
+            profiler.begin(threading.get_ident())
+
+    @app.after_request
+    def record_request_time(response):
+        start = flask.g.get('request_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        times, counts = request_timer.stop()
+        if flask.g.get('profiled'):
+            profiler.end(threading.get_ident())
+        if times is None:
+            return response
+
+        times['other'] = max(0.0, elapsed - sum(times.values()))
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.1f}'.format(category, seconds * 1000) for category, seconds in times.items())
+        response.headers['Server-Timing'] += ', total;dur={:.1f}'.format(elapsed * 1000)
+
+        if threshold is not None and elapsed >= threshold:
+            slow_request_log.warning(json.dumps({
+                'method': flask.request.method,
+                'path': flask.request.full_path,
+                'endpoint': flask.request.endpoint,
+                'status': response.status_code,
+                'elapsed': round(elapsed, 6),
+                'times': dict((category, round(seconds, 6)) for category, seconds in times.items()),
+                'calls': counts,
+            }))
+        return response
+
+    @app.teardown_request
+    def stop_request_timer(exc=None):
+        # after_request is skipped for unhandled errors
+        request_timer.stop()
+        if flask.g.get('profiled'):
+            profiler.end(threading.get_ident())
@@ -0,0 +1,213 @@
+import array
+import bisect
+import threading
+import time
+
+import libvirt
+
+from virtmgr.libs import util
+from virtmgr.libs.connection import connection_manager, cvmConnect
+from virtmgr import app
+
+
+SAMPLER_STATS = (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                 libvirt.VIR_DOMAIN_STATS_BALLOON |
+                 libvirt.VIR_DOMAIN_STATS_VCPU |
+                 libvirt.VIR_DOMAIN_STATS_INTERFACE |
+                 libvirt.VIR_DOMAIN_STATS_BLOCK)
+
+# sampled metrics, counters (cpu time in ns, bytes) and gauges (memory in KiB, vcpus)
+METRICS = ('cpu_time', 'memory', 'vcpus', 'disk_rd_bytes', 'disk_wr_bytes', 'net_rx_bytes', 'net_tx_bytes')
+COUNTERS = ('cpu_time', 'disk_rd_bytes', 'disk_wr_bytes', 'net_rx_bytes', 'net_tx_bytes')
+
+
+def _sum_indexed(stats, group, field):
+    return sum(stats.get('{}.{}.{}'.format(group, i, field), 0) for i in range(stats.get(group + '.count', 0)))
+
+
+def stats_to_sample(stats):
+    """converts a getAllDomainStats dict into a tuple of METRICS values"""
+    return (
+        stats.get('cpu.time', 0),
+        stats.get('balloon.rss', stats.get('balloon.current', 0)),
+        stats.get('vcpu.current', 0),
+        _sum_indexed(stats, 'block', 'rd.bytes'),
+        _sum_indexed(stats, 'block', 'wr.bytes'),
+        _sum_indexed(stats, 'net', 'rx.bytes'),
+        _sum_indexed(stats, 'net', 'tx.bytes'),
+    )
+
+
+def percentile(values, q):
+    """returns the q-th percentile (0-100) of values with linear interpolation"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+class cvmRingBuffer(object):
+    """
+    fixed size ring of samples backed by a single array of doubles,
+    every row holds the timestamp followed by one value per metric
+    """
+
+    def __init__(self, capacity, width=len(METRICS)):
+        self.capacity = capacity
+        self.row = width + 1
+        self._data = array.array('d', [0.0]) * (capacity * self.row)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        offset = self._next * self.row
+        self._data[offset] = timestamp
+        self._data[offset + 1:offset + self.row] = array.array('d', values)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def column(self, index, window=None, now=None):
+        """
+        returns (timestamps, values) of column index in chronological order,
+        limited to the last window seconds
+        """
+        start = (self._next - self._count) % self.capacity
+        # unroll the ring with two strided slices instead of a python loop per sample
+        if start + self._count <= self.capacity:
+            rows = self._data[start * self.row:(start + self._count) * self.row]
+        else:
+            rows = self._data[start * self.row:] + self._data[:self._next * self.row]
+
+        timestamps = rows[0::self.row]
+        values = rows[index + 1::self.row]
+        if window is not None and timestamps:
+            since = (now if now is not None else timestamps[-1]) - window
+            first = bisect.bisect_left(timestamps, since)
+            timestamps, values = timestamps[first:], values[first:]
+        return timestamps, values
+
+
+class cvmDomainSampler(threading.Thread):
+    """
+    background thread polling getAllDomainStats of every connected host
+    and keeping a bounded ring buffer of samples per domain
+    """
+
+    def __init__(self, interval=10, capacity=120, max_domains=10000, timeout=None):
+        super(cvmDomainSampler, self).__init__(name='domain sampler')
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+
+        self.interval = interval
+        self.capacity = capacity
+        self.max_domains = max_domains
+        self.timeout = timeout if timeout is not None else interval
+
+        # maps (hostname, domain name) to its cvmRingBuffer
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample_all()
+            except Exception as err:
+                app.logger.warning('domain sampler round failed: %s', err)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def sample_host(self, target):
+        hostname, conn = target
+        with cvmConnect(hostname, conn) as cvm:
+            stats = cvm.get_domain_stats(SAMPLER_STATS)
+        now = time.time()
+
+        with self._lock:
+            # forget domains which are gone from the host
+            for key in [key for key in self._buffers if key[0] == hostname and key[1] not in stats]:
+                del self._buffers[key]
+
+            for name, dom_stats in stats.items():
+                buf = self._buffers.get((hostname, name))
+                if buf is None:
+                    if len(self._buffers) >= self.max_domains:
+                        continue
+                    buf = self._buffers[(hostname, name)] = cvmRingBuffer(self.capacity)
+                buf.append(now, stats_to_sample(dom_stats))
+        return len(stats)
+
+    def sample_all(self):
+        # only hosts we already hold a connection to are sampled, nobody gets connected here
+        targets = connection_manager.connected_targets()
+        return util.map_concurrently(self.sample_host, targets, timeout=self.timeout)
+
+    def _column(self, hostname, name, metric, window):
+        with self._lock:
+            buf = self._buffers.get((hostname, name))
+            if buf is None:
+                return [], []
+            return buf.column(METRICS.index(metric), window, time.time())
+
+    def rates(self, hostname, name, metric, window=None):
+        """returns the per second rates of a counter between consecutive samples"""
+        timestamps, values = self._column(hostname, name, metric, window)
+        return [(v1 - v0) / (t1 - t0)
+                for t0, t1, v0, v1 in zip(timestamps, timestamps[1:], values, values[1:])
+                # skip counter resets (domain restarted)
+                if t1 > t0 and v1 >= v0]
+
+    def rate(self, hostname, name, metric, window=None):
+        """returns the average per second rate of a counter over the window"""
+        rates = self.rates(hostname, name, metric, window)
+        return sum(rates) / len(rates) if rates else None
+
+    def rate_percentile(self, hostname, name, metric, q, window=None):
+        return percentile(self.rates(hostname, name, metric, window), q)
+
+    def gauge(self, hostname, name, metric, window=None):
+        """returns the last value of a gauge and its percentiles over the window"""
+        timestamps, values = self._column(hostname, name, metric, window)
+        if not values:
+            return None
+        values = values.tolist()
+        return {'last': values[-1], 'p50': percentile(values, 50), 'p95': percentile(values, 95),
+                'max': max(values)}
+
+    def cpu_usage(self, hostname, name, window=None):
+        """returns the average cpu usage in percent of all vcpus of the domain over the window"""
+        rate = self.rate(hostname, name, 'cpu_time', window)
+        _, vcpus = self._column(hostname, name, 'vcpus', window)
+        if rate is None or not vcpus or not vcpus[-1]:
+            return None
+        return rate / 1e7 / vcpus[-1]
+
+    def summary(self, hostname, name, window=None):
+        """returns cpu usage, counter rates (avg and p95) and gauges of a domain"""
+        summary = {'cpu_usage': self.cpu_usage(hostname, name, window)}
+        for metric in COUNTERS:
+            rates = self.rates(hostname, name, metric, window)
+            summary[metric] = {'rate': sum(rates) / len(rates) if rates else None,
+                               'p95': percentile(rates, 95)}
+        for metric in ('memory', 'vcpus'):
+            summary[metric] = self.gauge(hostname, name, metric, window)
+        return summary
+
+    def domains(self, hostname=None):
+        with self._lock:
+            return [key for key in self._buffers if hostname is None or key[0] == hostname]
+
+
+domain_sampler = cvmDomainSampler(
+    app.config.get('DOMAIN_SAMPLER_INTERVAL', 10) or 10,
+    app.config.get('DOMAIN_SAMPLER_CAPACITY', 120),
+    app.config.get('DOMAIN_SAMPLER_MAX_DOMAINS', 10000)
+)
@@ -0,0 +1,46 @@
+import threading
+
+from virtmgr.libs.connection import connection_manager
+from virtmgr import app
+
+
+class cvmStorageRefresher(threading.Thread):
+    """
+    background thread asking libvirtd to rescan the storage pools of every connected
+    host, hosts are handled one after the other and every pool at most once per interval
+    """
+
+    def __init__(self, interval=300):
+        super(cvmStorageRefresher, self).__init__(name='storage refresher')
+        # run in deamon mode, so it does not block shutdown of the server
+        self.daemon = True
+
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_all()
+            except Exception as err:
+                app.logger.warning('storage refresh round failed: %s', err)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh_all(self):
+        # only hosts we already hold a connection to are refreshed, nobody gets connected here
+        refreshed = 0
+        for hostname, conn in connection_manager.connected_targets():
+            if self._stop_event.is_set():
+                break
+            index = connection_manager.get_storage_index(hostname, conn)
+            if index.synced:
+                refreshed += index.refresh_pools(self.interval)
+        return refreshed
+
+
+storage_refresher = cvmStorageRefresher(
+    app.config.get('STORAGE_REFRESH_INTERVAL', 300) or 300
+)
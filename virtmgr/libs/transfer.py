@@ -0,0 +1,363 @@
+import hashlib
+import json
+import os
+import shlex
+import tempfile
+import threading
+import time
+
+import paramiko
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# parallel sftp channels per transfer and size of the chunks they work on
+SFTP_STREAMS = 4
+SFTP_CHUNK_SIZE = 8 * 1024 * 1024
+# size of the single read/write requests, sftp servers commonly cap them at 32k
+SFTP_BLOCK_SIZE = 32 * 1024
+
+# journals of unfinished transfers, used to resume them
+JOURNAL_DIR = os.path.join(tempfile.gettempdir(), 'virtmgr-transfers')
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+
+class cvmTransferError(Exception):
+    pass
+
+
+class cvmTransportPool(object):
+    """
+    keeps one authenticated ssh transport per (hostname, port, login) and reuses it
+    for all transfers, every transfer opens its own sftp channels on it
+    """
+
+    def __init__(self):
+        self._transports = {}
+        # one lock per key, connecting to a slow host must not block transfers to the others
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get_transport(self, server_host):
+        key = (server_host.hostname, server_host.ssh_port, server_host.ssh_login)
+        transport = self._transports.get(key)
+        if transport is not None and transport.is_active():
+            return transport
+
+        with self._key_lock(key):
+            transport = self._transports.get(key)
+            if transport is None or not transport.is_active():
+                transport = paramiko.Transport((server_host.hostname, server_host.ssh_port))
+                try:
+                    transport.set_keepalive(30)
+                    transport.connect(username=server_host.ssh_login, password=server_host.ssh_password)
+                except Exception:
+                    # do not leak the socket and the transport thread of a failed attempt
+                    transport.close()
+                    raise
+                with self._lock:
+                    self._transports[key] = transport
+        return transport
+
+    def open_sftp(self, server_host):
+        return paramiko.SFTPClient.from_transport(self.get_transport(server_host))
+
+    def close_all(self):
+        with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+        for transport in transports:
+            transport.close()
+
+
+transport_pool = cvmTransportPool()
+
+
+class _Journal(object):
+    """
+    records the finished chunks of a transfer with the sha256 of their data, it is
+    only valid for the same file (size and mtime of the source) and chunk size
+    """
+
+    def __init__(self, key, identity):
+        self.path = os.path.join(JOURNAL_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+        self.identity = identity
+        # chunk index -> sha256 of the chunk
+        self.done = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('identity') == identity:
+                # json object keys are strings
+                self.done = dict((int(index), digest) for index, digest in data['done'].items())
+        except (IOError, ValueError, KeyError, AttributeError):
+            pass
+
+    def mark_done(self, index, digest):
+        with self._lock:
+            self.done[index] = digest
+            self._write()
+
+    def discard(self, indexes):
+        """forgets the given chunks, they are transferred again on resume"""
+        with self._lock:
+            for index in indexes:
+                self.done.pop(index, None)
+            self._write()
+
+    def _write(self):
+        # needs the lock
+        if not os.path.isdir(JOURNAL_DIR):
+            os.makedirs(JOURNAL_DIR)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'identity': self.identity, 'done': self.done}, f)
+        os.rename(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _remote_chunk_hashes(transport, path, chunk_size, count):
+    """
+    hashes the chunks of the remote file on the server itself, nothing is read back
+    returns the sha256 of every chunk, None if the account may not run commands
+    """
+    command = 'for i in $(seq 0 {}); do dd if={} bs={} skip=$i count=1 2>/dev/null | sha256sum; done'.format(
+        count - 1, shlex.quote(path), chunk_size)
+    try:
+        channel = transport.open_session()
+        try:
+            channel.exec_command(command)
+            output = channel.makefile('r').read()
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+    except paramiko.SSHException:
+        return None
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+    hashes = [line.split()[0] for line in output.splitlines() if line.strip()]
+    if status != 0 or len(hashes) != count:
+        return None
+    return hashes
+
+
+def _hash_local_range(path, offset, length):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(1024 * 1024, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _hash_remote_range(server_host, path, offset, length):
+    digest = hashlib.sha256()
+    sftp = transport_pool.open_sftp(server_host)
+    try:
+        with sftp.open(path, 'r') as remote:
+            for block in remote.readv([(offset, length)]):
+                digest.update(block)
+    finally:
+        sftp.close()
+    return digest.hexdigest()
+
+
+def _verify(server_host, local_path, remote_path, direction, chunks, chunk_size, journal, resumed_chunks):
+    """
+    compares the journaled chunk hashes with the target, on the server with sha256sum
+    if the account may run commands, otherwise the chunks restored from the journal are
+    read back (this run's chunks went over the integrity protected ssh channel)
+    drops mismatching chunks from the journal, returns how the transfer was verified
+    raises cvmTransferError on a mismatch
+    """
+    remote_hashes = _remote_chunk_hashes(
+        transport_pool.get_transport(server_host), remote_path, chunk_size, len(chunks)) if chunks else []
+    if remote_hashes is not None:
+        verified = 'remote'
+        actual = dict(zip([index for index, _, _ in chunks], remote_hashes))
+    else:
+        verified = 'resumed'
+        actual = {}
+        for index, offset, length in resumed_chunks:
+            if direction == UPLOAD:
+                actual[index] = _hash_remote_range(server_host, remote_path, offset, length)
+            else:
+                actual[index] = _hash_local_range(local_path, offset, length)
+
+    corrupt = [index for index, digest in actual.items() if digest != journal.done.get(index)]
+    if corrupt:
+        # only these chunks are transferred again on resume
+        journal.discard(corrupt)
+        raise cvmTransferError('checksum mismatch for {} in chunks {}'.format(remote_path, sorted(corrupt)))
+    return verified
+
+
+def _upload_chunk(server_host, local_path, remote_path, offset, length):
+    """transfers a chunk, returns the sha256 of the data sent"""
+    digest = hashlib.sha256()
+    sftp = transport_pool.open_sftp(server_host)
+    try:
+        with open(local_path, 'rb') as source, sftp.open(remote_path, 'r+') as remote:
+            # do not wait for the ack of every single write
+            remote.set_pipelined(True)
+            source.seek(offset)
+            remote.seek(offset)
+            remaining = length
+            while remaining > 0:
+                block = source.read(min(SFTP_BLOCK_SIZE, remaining))
+                if not block:
+                    raise cvmTransferError('{} was truncated during the transfer'.format(local_path))
+                remote.write(block)
+                digest.update(block)
+                remaining -= len(block)
+    finally:
+        sftp.close()
+    return digest.hexdigest()
+
+
+def _download_chunk(server_host, remote_path, local_path, offset, length):
+    """transfers a chunk, returns the sha256 of the data received"""
+    digest = hashlib.sha256()
+    received = 0
+    sftp = transport_pool.open_sftp(server_host)
+    try:
+        with sftp.open(remote_path, 'r') as remote, open(local_path, 'r+b') as target:
+            target.seek(offset)
+            # readv pipelines all read requests of the chunk
+            for block in remote.readv([(offset, length)]):
+                target.write(block)
+                digest.update(block)
+                received += len(block)
+    finally:
+        sftp.close()
+    if received != length:
+        raise cvmTransferError('{} was truncated during the transfer'.format(remote_path))
+    return digest.hexdigest()
+
+
+def transfer(server_host, local_path, remote_path, direction, streams=SFTP_STREAMS,
+             chunk_size=SFTP_CHUNK_SIZE, resume=True, verify=True):
+    """
+    transfers a file from/to the given server over sftp, split into chunks which are
+    transferred by several parallel sftp channels on one pooled ssh transport
+    finished chunks are journaled with the sha256 of their data (hashed while being
+    transferred), an interrupted transfer resumes with the missing ones
+    with verify the journaled hashes are compared with the target, see _verify
+    returns a dict with the transferred bytes, elapsed time, throughput (bytes/s) and
+    how the transfer was verified ('remote', 'resumed' or None)
+    raises cvmTransferError if the transfer or the verification fails
+    """
+    start = time.time()
+    try:
+        sftp = transport_pool.open_sftp(server_host)
+        try:
+            if direction == UPLOAD:
+                stat = os.stat(local_path)
+                size, mtime = stat.st_size, int(stat.st_mtime)
+            else:
+                stat = sftp.stat(remote_path)
+                size, mtime = stat.st_size, stat.st_mtime
+
+            key = '{}|{}|{}|{}|{}'.format(
+                direction, server_host.hostname, server_host.ssh_port, local_path, remote_path)
+            journal = _Journal(key, [size, mtime, chunk_size])
+            if not resume:
+                journal.done = {}
+
+            # the target has to exist before the chunks get written at their offsets
+            if direction == UPLOAD:
+                if journal.done:
+                    try:
+                        sftp.stat(remote_path)
+                    except IOError:
+                        journal.done = {}
+                if not journal.done:
+                    with sftp.open(remote_path, 'w'):
+                        pass
+            else:
+                if not journal.done or not os.path.exists(local_path):
+                    journal.done = {}
+                    with open(local_path, 'wb') as target:
+                        target.truncate(size)
+        finally:
+            sftp.close()
+
+        chunks = [(index, offset, min(chunk_size, size - offset))
+                  for index, offset in enumerate(range(0, size, chunk_size))]
+        pending = [chunk for chunk in chunks if chunk[0] not in journal.done]
+        resumed_chunks = [chunk for chunk in chunks if chunk[0] in journal.done]
+        resumed = sum(length for _, _, length in resumed_chunks)
+
+        def run_chunk(chunk):
+            index, offset, length = chunk
+            if direction == UPLOAD:
+                digest = _upload_chunk(server_host, local_path, remote_path, offset, length)
+            else:
+                digest = _download_chunk(server_host, remote_path, local_path, offset, length)
+            journal.mark_done(index, digest)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(streams, len(pending)))) as executor:
+                # list() re-raises the first failed chunk
+                list(executor.map(run_chunk, pending))
+
+        verified = None
+        if verify:
+            if direction == UPLOAD:
+                sftp = transport_pool.open_sftp(server_host)
+                try:
+                    target_size = sftp.stat(remote_path).st_size
+                finally:
+                    sftp.close()
+            else:
+                target_size = os.path.getsize(local_path)
+            if target_size != size:
+                # start over next time, the target was changed by someone else
+                journal.remove()
+                raise cvmTransferError('size mismatch for {}: {} != {}'.format(remote_path, target_size, size))
+            verified = _verify(server_host, local_path, remote_path, direction, chunks, chunk_size, journal,
+                               resumed_chunks)
+        journal.remove()
+    except cvmTransferError:
+        raise
+    except Exception as err:
+        raise cvmTransferError(str(err))
+
+    elapsed = time.time() - start
+    transferred = size - resumed
+    return {
+        'bytes': transferred,
+        'resumed_bytes': resumed,
+        'elapsed': elapsed,
+        'throughput': transferred / elapsed if elapsed > 0 else None,
+        'verified': verified,
+    }
+
+
+def upload(server_host, local_path, remote_path, **kwargs):
+    return transfer(server_host, local_path, remote_path, UPLOAD, **kwargs)
+
+
+def download(server_host, remote_path, local_path, **kwargs):
+    return transfer(server_host, local_path, remote_path, DOWNLOAD, **kwargs)
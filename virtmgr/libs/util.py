@@ -1,10 +1,18 @@
+import collections
+import concurrent.futures
+import hashlib
 import random
+import threading
+import time
+import weakref
 import libxml2
 import libvirt
-import paramiko
 from flask_restful import reqparse
 from functools import wraps
 
+from virtmgr.libs import transfer
+from virtmgr.libs.profiling import TIME_XML, request_timer
+
 # from rest_framework import serializers
 
 
@@ -34,15 +42,30 @@ def randomUUID():
     return "-".join(["%02x" * 4, "%02x" * 2, "%02x" * 2, "%02x" * 2, "%02x" * 6]) % tuple(u)
 
 
+# max vcpus per libvirt connection object and guest type, it only changes when libvirtd restarts
+# which also means a new connection object
+_max_vcpus = weakref.WeakKeyDictionary()
+_max_vcpus_lock = threading.Lock()
+
+
 def get_max_vcpus(conn, type=None):
     """@param conn: libvirt connection to poll for max possible vcpus
        @type type: optional guest type (kvm, etc.)"""
+    with _max_vcpus_lock:
+        cached = _max_vcpus.get(conn, {})
+        if type in cached:
+            return cached[type]
+
+    key = type
     if type is None:
         type = conn.getType()
     try:
         m = conn.getMaxVcpus(type.lower())
     except libvirt.libvirtError:
         m = 32
+
+    with _max_vcpus_lock:
+        _max_vcpus.setdefault(conn, {})[key] = m
     return m
 
 
@@ -79,39 +102,253 @@ def compareMAC(p, q):
     return 0
 
 
+# bounds of the parsed document cache used by get_xml_path
+XML_DOC_CACHE_SIZE = 128
+XML_DOC_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+class XMLDocument(object):
+    """
+    A parsed xml document which answers any number of xpath queries.
+    Documents never change, so the result of every path query is memoized.
+    Functions passed to call() must not keep references to nodes, the
+    underlying libxml2 document may be freed once it is evicted.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.size = len(xml)
+        # libxml2 xpath contexts are not thread safe
+        self._lock = threading.Lock()
+        self._doc = None
+        self._ctx = None
+        # set by free(), later queries parse the document only for their own use
+        self._freed = False
+        self._results = {}
+
+    def _open(self):
+        # needs the lock, an evicted document is parsed again if someone still uses it
+        if self._doc is None:
+            self._doc = libxml2.parseDoc(self.xml)
+            self._ctx = self._doc.xpathNewContext()
+        # functions passed to call() may have moved the context node
+        self._ctx.setContextNode(self._doc)
+        return self._ctx
+
+    def _close(self):
+        # needs the lock, documents parsed again after free() are not kept
+        if self._freed:
+            self._release()
+
+    def _release(self):
+        if self._ctx:
+            self._ctx.xpathFreeContext()
+        if self._doc:
+            self._doc.freeDoc()
+        self._ctx = None
+        self._doc = None
+
+    def get(self, path):
+        """Return the content of the first node matched by path (or the xpath value)"""
+        try:
+            return self._results[path]
+        except KeyError:
+            pass
+
+        result = None
+        with self._lock, request_timer.measure(TIME_XML):
+            try:
+                ret = self._open().xpathEval(path)
+                if ret is not None:
+                    if type(ret) == list:
+                        if len(ret) >= 1:
+                            result = ret[0].content
+                    else:
+                        result = ret
+            finally:
+                self._close()
+        self._results[path] = result
+        return result
+
+    def get_all(self, path):
+        """Return the contents of all nodes matched by path"""
+        key = ('all', path)
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+
+        with self._lock, request_timer.measure(TIME_XML):
+            try:
+                ret = self._open().xpathEval(path)
+                result = [node.content for node in ret] if type(ret) == list else []
+            finally:
+                self._close()
+        self._results[key] = result
+        return result
+
+    def call(self, func):
+        """Return the result of func, which receives the xpathContext as its only arg"""
+        with self._lock, request_timer.measure(TIME_XML):
+            try:
+                return func(self._open())
+            finally:
+                self._close()
+
+    def free(self):
+        with self._lock:
+            self._freed = True
+            self._release()
+
+
+class XMLDocumentCache(object):
+    """
+    LRU cache of parsed documents keyed by the hash of the xml content,
+    bounded by the number of documents and their total xml size
+    """
+
+    def __init__(self, max_entries=XML_DOC_CACHE_SIZE, max_bytes=XML_DOC_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._docs = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, xml):
+        data = xml.encode('utf-8') if isinstance(xml, str) else xml
+        key = hashlib.sha1(data).hexdigest()
+
+        evicted = []
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is not None:
+                self._docs.move_to_end(key)
+                return doc
+
+            doc = XMLDocument(xml)
+            self._docs[key] = doc
+            self._bytes += doc.size
+            while len(self._docs) > 1 and (len(self._docs) > self.max_entries or self._bytes > self.max_bytes):
+                _, old = self._docs.popitem(last=False)
+                self._bytes -= old.size
+                evicted.append(old)
+
+        for old in evicted:
+            old.free()
+        return doc
+
+    def clear(self):
+        with self._lock:
+            docs = list(self._docs.values())
+            self._docs.clear()
+            self._bytes = 0
+        for doc in docs:
+            doc.free()
+
+
+xml_doc_cache = XMLDocumentCache()
+
+
+def get_xml_doc(xml):
+    """Return the (cached) parsed XMLDocument of the passed xml"""
+    return xml_doc_cache.get(xml)
+
+
 def get_xml_path(xml, path=None, func=None):
     """
     Return the content from the passed xml xpath, or return the result
     of a passed function (receives xpathContext as its only arg)
     """
-    doc = None
-    ctx = None
-    result = None
+    if path:
+        return get_xml_doc(xml).get(path)
+    elif func:
+        return get_xml_doc(xml).call(func)
+    else:
+        raise ValueError("'path' or 'func' is required.")
 
-    try:
-        doc = libxml2.parseDoc(xml)
-        ctx = doc.xpathNewContext()
 
-        if path:
-            ret = ctx.xpathEval(path)
-            if ret is not None:
-                if type(ret) == list:
-                    if len(ret) >= 1:
-                        result = ret[0].content
-                else:
-                    result = ret
+def map_concurrently(func, items, max_workers=16, timeout=None, item_timeout=None):
+    """
+    Call func for every item in a bounded thread pool, waiting at most timeout
+    seconds for all of them. Return a dict mapping each item to (result, error),
+    items which did not finish in time get a TimeoutError, items whose call did
+    not even start in time get a concurrent.futures.CancelledError.
+    With item_timeout every item gets that many seconds counted from the start
+    of its own call, see _map_item_timeouts.
+    """
+    items = list(items)
+    results = {}
+    if not items:
+        return results
+    if item_timeout is not None:
+        return _map_item_timeouts(func, items, max_workers, timeout, item_timeout)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = dict((executor.submit(func, item), item) for item in items)
+        done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        for future in done:
+            error = future.exception()
+            results[futures[future]] = (None, error) if error is not None else (future.result(), None)
+        for future in not_done:
+            if future.cancel():
+                error = concurrent.futures.CancelledError('not started within {}s'.format(timeout))
+            else:
+                error = TimeoutError('timed out after {}s'.format(timeout))
+            results[futures[future]] = (None, error)
+    finally:
+        # do not wait for stragglers, they finish in the background
+        executor.shutdown(wait=False)
+    return results
 
-        elif func:
-            result = func(ctx)
 
-        else:
-            raise ValueError("'path' or 'func' is required.")
+def _map_item_timeouts(func, items, max_workers, timeout, item_timeout):
+    """
+    at most max_workers calls run at a time, a call which exceeds item_timeout is
+    abandoned (its thread finishes in the background) and frees its slot for the
+    next item, so items queued behind hung ones still get their full time
+    """
+    results = {}
+    start = time.monotonic()
+    pending = collections.deque(items)
+    # future -> (item, deadline)
+    running = {}
+    # abandoned threads do not count against max_workers, the executor may need one per item
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(items))
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                item = pending.popleft()
+                running[executor.submit(func, item)] = (item, time.monotonic() + item_timeout)
+
+            wait = min(deadline for _, deadline in running.values())
+            if timeout is not None:
+                wait = min(wait, start + timeout)
+            done, _ = concurrent.futures.wait(
+                running, timeout=max(0, wait - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item, _ = running.pop(future)
+                error = future.exception()
+                results[item] = (None, error) if error is not None else (future.result(), None)
+
+            now = time.monotonic()
+            for future, (item, deadline) in list(running.items()):
+                if deadline <= now:
+                    del running[future]
+                    results[item] = (None, TimeoutError('timed out after {}s'.format(item_timeout)))
+
+            if timeout is not None and now >= start + timeout:
+                for future, (item, _) in running.items():
+                    future.cancel()
+                    results[item] = (None, TimeoutError('timed out after {}s'.format(timeout)))
+                for item in pending:
+                    results[item] = (None, concurrent.futures.CancelledError(
+                        'not started within {}s'.format(timeout)))
+                break
     finally:
-        if doc:
-            doc.freeDoc()
-        if ctx:
-            ctx.xpathFreeContext()
-    return result
+        # do not wait for stragglers, they finish in the background
+        executor.shutdown(wait=False)
+    return results
 
 
 def pretty_mem(val):
@@ -156,6 +393,10 @@ def pretty_bytes(val):
 
 
 def handle_uploaded_file(server_host, upload_type, path, f_name):
+    """
+    Store an uploaded file locally or push it to the server, remote uploads
+    are chunked, parallel, resumable and checksum verified (see transfer.upload)
+    """
     target = path + '/' + str(f_name)
     if upload_type == 'local':
         destination = open(target, 'wb+')
@@ -164,22 +405,9 @@ def handle_uploaded_file(server_host, upload_type, path, f_name):
         destination.close()
     else:
         file_abspath = str(f_name.temporary_file_path())
-        try:
-            t = paramiko.Transport((server_host.hostname, server_host.ssh_port))
-            t.connect(username=server_host.ssh_login, password=server_host.ssh_password)
-            sftp = paramiko.SFTPClient.from_transport(t)
-            sftp.put(file_abspath, target)
-            t.close()
-        except Exception as err:
-            raise get_validation_error(str(err))
+        return transfer.upload(server_host, file_abspath, target)
 
 
 def handle_downloaded_file(server_host, f_name, path):
-    try:
-        t = paramiko.Transport((server_host.hostname, server_host.ssh_port))
-        t.connect(username=server_host.ssh_login, password=server_host.ssh_password)
-        sftp = paramiko.SFTPClient.from_transport(t)
-        sftp.get(f_name, path)
-        t.close()
-    except Exception as err:
-        raise get_validation_error(str(err))
+    """Fetch a file from the server, returns the transfer report (see transfer.download)"""
+    return transfer.download(server_host, f_name, path)
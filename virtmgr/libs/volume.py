@@ -0,0 +1,131 @@
+import errno
+import mmap
+import os
+import time
+
+import libvirt
+
+
+def _hole_handler(stream, fd):
+    """
+    reports whether the current position of fd is in data or in a hole
+    and how long that section is, see virStreamSparseSendAll
+    """
+    cur = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        data = os.lseek(fd, cur, os.SEEK_DATA)
+    except OSError as err:
+        if err.errno != errno.ENXIO:
+            raise
+        # no more data until the end of file
+        data = -1
+
+    if data < 0:
+        in_data = False
+        section = os.lseek(fd, 0, os.SEEK_END) - cur
+    elif data > cur:
+        in_data = False
+        section = data - cur
+    else:
+        in_data = True
+        section = os.lseek(fd, data, os.SEEK_HOLE) - data
+
+    os.lseek(fd, cur, os.SEEK_SET)
+    return [in_data, section]
+
+
+def _send_skip_handler(stream, length, fd):
+    os.lseek(fd, length, os.SEEK_CUR)
+    return 0
+
+
+def _recv_hole_handler(stream, length, fd):
+    # punch the hole by growing the file without writing
+    cur = os.lseek(fd, length, os.SEEK_CUR)
+    os.ftruncate(fd, cur)
+    return 0
+
+
+def _recv_handler(stream, data, fd):
+    return os.write(fd, data)
+
+
+def _report(size, start):
+    elapsed = time.time() - start
+    return {'bytes': size, 'elapsed': elapsed, 'throughput': size / elapsed if elapsed > 0 else None}
+
+
+def upload(conn, vol, path, sparse=True, progress=None):
+    """
+    uploads the local file to the storage volume through a libvirt stream over the existing
+    connection, the file is mapped into memory instead of being read into buffers and holes
+    of sparse files are skipped instead of sent
+    progress(position, size) is called for every block, exceptions raised by it abort the upload
+    returns a dict with the size, elapsed time and throughput (bytes/s)
+    """
+    start = time.time()
+    fd = os.open(path, os.O_RDONLY)
+    mapped = None
+    stream = conn.newStream(0)
+    try:
+        size = os.fstat(fd).st_size
+        if size:
+            mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+        def send_handler(stream, nbytes, fd):
+            # the fd position is shared with the hole/skip handlers, the data comes from the mapping
+            cur = os.lseek(fd, 0, os.SEEK_CUR)
+            data = mapped[cur:cur + nbytes] if mapped is not None else b''
+            os.lseek(fd, len(data), os.SEEK_CUR)
+            if progress is not None:
+                # the position includes skipped holes
+                progress(cur + len(data), size)
+            return data
+
+        if sparse:
+            vol.upload(stream, 0, size, libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+            stream.sparseSendAll(send_handler, _hole_handler, _send_skip_handler, fd)
+        else:
+            vol.upload(stream, 0, size, 0)
+            stream.sendAll(send_handler, fd)
+        stream.finish()
+    except Exception:
+        try:
+            stream.abort()
+        except libvirt.libvirtError:
+            pass
+        raise
+    finally:
+        if mapped is not None:
+            mapped.close()
+        os.close(fd)
+    return _report(size, start)
+
+
+def download(conn, vol, path, sparse=True):
+    """
+    downloads the storage volume into the local file through a libvirt stream,
+    holes are recreated locally instead of being transferred as zeros
+    returns a dict with the size, elapsed time and throughput (bytes/s)
+    """
+    start = time.time()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    stream = conn.newStream(0)
+    try:
+        if sparse:
+            vol.download(stream, 0, 0, libvirt.VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM)
+            stream.sparseRecvAll(_recv_handler, _recv_hole_handler, fd)
+        else:
+            vol.download(stream, 0, 0, 0)
+            stream.recvAll(_recv_handler, fd)
+        stream.finish()
+        size = os.lseek(fd, 0, os.SEEK_END)
+    except Exception:
+        try:
+            stream.abort()
+        except libvirt.libvirtError:
+            pass
+        raise
+    finally:
+        os.close(fd)
+    return _report(size, start)
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from virtmgr.libs.connection import connection_manager
-from virtmgr import db
+import datetime
+import json
+
+from virtmgr.libs.monitor import host_monitor
+from virtmgr import app, db
 
 
 class BasicModel(db.Model):
@@ -16,6 +19,7 @@ class HostServer(BasicModel):
     ssh_login = db.Column(db.String(20), unique=True, nullable=False)
     ssh_password = db.Column(db.String(32), unique=True, nullable=False)
     ssh_port = db.Column(db.Integer, default=22)
+    # connection type, see CONN_* in virtmgr.libs.connection (0 picks the fastest transport)
     type = db.Column(db.Integer, default=1)
 
     __tablename__ = 'server_host'
@@ -25,4 +29,53 @@ class HostServer(BasicModel):
 
     @property
     def is_alive(self):
-        return True if connection_manager.host_is_up(self.hostname) == 1 else False
+        return host_monitor.is_alive(self.hostname)
+
+    @property
+    def status(self):
+        return host_monitor.status(self.hostname)
+
+    @classmethod
+    def connection_targets(cls):
+        """ returns (hostname, connection type) of every registered server """
+        with app.app_context():
+            return [(server_host.hostname, server_host.type) for server_host in cls.query.all()]
+
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+JOB_FINISHED = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class Job(BasicModel):
+    type = db.Column(db.String(64), nullable=False)
+    server_id = db.Column(db.Integer, db.ForeignKey('server_host.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=JOB_PENDING)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255))
+    params = db.Column(db.Text)
+    result = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    server = db.relationship(HostServer)
+
+    __tablename__ = 'job'
+
+    def __str__(self):
+        return '{} #{}'.format(self.type, self.id)
+
+    @property
+    def finished(self):
+        return self.status in JOB_FINISHED
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from virtmgr import app
+from virtmgr.libs.connection import connection_manager
+from virtmgr.libs.jobs import job_manager
+from virtmgr.libs.monitor import host_monitor
+from virtmgr.libs.pool_maintainer import pool_maintainer
+from virtmgr.libs.sampler import domain_sampler
+from virtmgr.libs.storage import storage_refresher
+from virtmgr.models import HostServer
+
+
+def warm_up_connections():
+    """ 并行预建到所有server的libvirt连接，并记录每台server的耗时和错误 """
+    report = connection_manager.warm_up(
+        HostServer.connection_targets(),
+        app.config.get('LIBVIRT_WARMUP_CONCURRENCY', 16),
+        app.config.get('LIBVIRT_WARMUP_TIMEOUT', 60))
+    for (hostname, conn), result in sorted(report.items()):
+        if result['error'] is None:
+            app.logger.info('warmed up connection to %s in %.3fs', hostname, result['elapsed'])
+        else:
+            app.logger.warning('warming up connection to %s failed: %s', hostname, result['error'])
+    return report
+
+
+def start_job_manager():
+    """
+    启动异步任务的工作线程，由服务入口在数据库就绪后调用（import时不访问数据库）
+    """
+    if app.config.get('JOB_WORKERS'):
+        job_manager.start()
+
+
+def start_background_tasks():
+    """
+    启动主机监控、采样、存储刷新和连接预热，由服务入口调用（import virtmgr时不启动）
+    """
+    if app.config.get('HOST_MONITOR_INTERVAL'):
+        host_monitor.hosts_func = HostServer.connection_targets
+        host_monitor.start()
+
+    if app.config.get('DOMAIN_SAMPLER_INTERVAL'):
+        domain_sampler.start()
+
+    if app.config.get('STORAGE_REFRESH_INTERVAL'):
+        storage_refresher.start()
+
+    if app.config.get('LIBVIRT_POOL_MAINTENANCE_INTERVAL'):
+        pool_maintainer.start()
+
+    if app.config.get('LIBVIRT_WARMUP'):
+        # warm up in the background, the app serves requests right away
+        threading.Thread(target=warm_up_connections, name='connection warm-up', daemon=True).start()
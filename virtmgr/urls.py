@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
 
 
+from virtmgr.api.domain import DomainActionsR, DomainsR, DomainUsageR
 from virtmgr.api.hello import Hello
-from virtmgr.api.server import NetPoolsR, ServersR, ServerR
+from virtmgr.api.job import JobR, JobsR
+from virtmgr.api.metrics import MetricsR
+from virtmgr.api.profile import ProfileR
+from virtmgr.api.server import (NetPoolsR, ServersR, ServersStatsR, ServersStorageR, ServerR, ServerStatusR,
+                                StoragePoolsR)
 from virtmgr import flask_api
 
 
 resources = {
     '/hello/': Hello,
     '/servers/': ServersR,
+    '/servers/stats/': ServersStatsR,
+    '/servers/storage/': ServersStorageR,
     '/servers/<server_id>/': ServerR,
+    '/servers/<server_id>/status/': ServerStatusR,
     '/servers/<server_id>/net_pools/': NetPoolsR,
+    '/servers/<server_id>/storage_pools/': StoragePoolsR,
+    '/servers/<server_id>/domains/': DomainsR,
+    '/servers/<server_id>/domains/<name>/usage/': DomainUsageR,
+    '/domains/actions/': DomainActionsR,
+    '/jobs/': JobsR,
+    '/jobs/<job_id>/': JobR,
+    '/metrics': MetricsR,
+    '/profile/': ProfileR,
 }
 
 
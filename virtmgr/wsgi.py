@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+WSGI serving mode for gunicorn, uWSGI and the like, e.g. `gunicorn virtmgr.wsgi:application`
+
+The background tasks and job workers are started here (once per worker process),
+importing virtmgr alone does not start them.
+"""
+
+from virtmgr import app
+from virtmgr.startup import start_background_tasks, start_job_manager
+
+
+start_background_tasks()
+start_job_manager()
+
+application = app